@@ -0,0 +1,520 @@
+"""
+This file contains an alternative GameState backend that keeps the position in 64-bit integer bitboards.
+It keeps the same makeMove/undoMove/getValidMoves contract as Engine.GameState, so ChessAI and Main can switch to it.
+Squares are numbered row * 8 + column, so bit 0 is a8 and bit 63 is h1 (the same orientation as the 8x8 board list).
+"""
+import Engine
+
+# Ray directions as (row step, column step). Rays in the first four directions increase the square index,
+# the last four decrease it. This tells the sliding attack lookup whether the nearest blocker is the lowest or highest bit.
+POSITIVE_DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+NEGATIVE_DIRECTIONS = ((-1, 0), (0, -1), (-1, -1), (-1, 1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+QUEEN_DIRECTIONS = BISHOP_DIRECTIONS + ROOK_DIRECTIONS
+
+SQUARES = [(row, column) for row in range(8) for column in range(8)]  # square index -> (row, column)
+PIECES = [color + piece for color in 'wb' for piece in 'pnbrqk']
+
+
+def _onBoard(row, column):
+    return 0 <= row < 8 and 0 <= column < 8
+
+
+def _stepAttacks(steps):
+    table = []
+    for row, column in SQUARES:
+        attacks = 0
+        for rowStep, columnStep in steps:
+            if _onBoard(row + rowStep, column + columnStep):
+                attacks |= 1 << ((row + rowStep) * 8 + column + columnStep)
+        table.append(attacks)
+    return table
+
+
+def _rays(direction):
+    table = []
+    for row, column in SQUARES:
+        ray = 0
+        endRow, endColumn = row + direction[0], column + direction[1]
+        while _onBoard(endRow, endColumn):
+            ray |= 1 << (endRow * 8 + endColumn)
+            endRow, endColumn = endRow + direction[0], endColumn + direction[1]
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _stepAttacks(((1, 2), (1, -2), (2, 1), (2, -1), (-1, 2), (-1, -2), (-2, 1), (-2, -1)))
+KING_ATTACKS = _stepAttacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares attacked by a pawn of the given color standing on a square
+PAWN_ATTACKS = {'w': _stepAttacks(((-1, -1), (-1, 1))), 'b': _stepAttacks(((1, -1), (1, 1)))}
+RAYS = {direction: _rays(direction) for direction in POSITIVE_DIRECTIONS + NEGATIVE_DIRECTIONS}
+# (rays, whether they increase the square index) per direction, for the pin and check scan from the king
+STRAIGHT_LINES = tuple((RAYS[direction], direction in POSITIVE_DIRECTIONS) for direction in ROOK_DIRECTIONS)
+DIAGONAL_LINES = tuple((RAYS[direction], direction in POSITIVE_DIRECTIONS) for direction in BISHOP_DIRECTIONS)
+# all the squares on the rook lines and on the bishop lines through each square
+STRAIGHT_LINE_MASKS = [sum(rays[square] for rays, positive in STRAIGHT_LINES) for square in range(64)]
+DIAGONAL_LINE_MASKS = [sum(rays[square] for rays, positive in DIAGONAL_LINES) for square in range(64)]
+ROW_MASKS = [0xFF << (row * 8) for row in range(8)]
+COLUMN_MASKS = [0x0101010101010101 << column for column in range(8)]
+FULL_BOARD = (1 << 64) - 1
+
+
+'''
+Attacks of a sliding piece on square along the given directions, stopping at (and including) the first blocker
+'''
+def slidingAttacks(square, occupied, directions):
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                blocker = (blockers & -blockers).bit_length() - 1  # nearest blocker is the lowest bit
+            else:
+                blocker = blockers.bit_length() - 1  # nearest blocker is the highest bit
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+'''
+The squares that can block a slider on each square along the given directions: its rays without their last square,
+since a piece on the edge of the board has nothing behind it to block
+'''
+def _blockerMasks(directions):
+    table = []
+    for square in range(64):
+        mask = 0
+        for direction in directions:
+            ray = RAYS[direction][square]
+            if ray:
+                edge = ray.bit_length() - 1 if direction in POSITIVE_DIRECTIONS else (ray & -ray).bit_length() - 1
+                mask |= ray ^ (1 << edge)
+        table.append(mask)
+    return table
+
+
+ROOK_BLOCKER_MASKS = _blockerMasks(ROOK_DIRECTIONS)
+BISHOP_BLOCKER_MASKS = _blockerMasks(BISHOP_DIRECTIONS)
+# Slider attacks per square, keyed by the occupancy of its blocker mask and filled in as positions come up.
+# This is what magic bitboards do, with the dictionary standing in for the magic multiplication.
+ROOK_ATTACK_TABLES = [{} for _ in SQUARES]
+BISHOP_ATTACK_TABLES = [{} for _ in SQUARES]
+
+
+def rookAttacks(square, occupied):
+    blockers = occupied & ROOK_BLOCKER_MASKS[square]
+    table = ROOK_ATTACK_TABLES[square]
+    attacks = table.get(blockers)
+    if attacks is None:
+        attacks = table[blockers] = slidingAttacks(square, blockers, ROOK_DIRECTIONS)
+    return attacks
+
+
+def bishopAttacks(square, occupied):
+    blockers = occupied & BISHOP_BLOCKER_MASKS[square]
+    table = BISHOP_ATTACK_TABLES[square]
+    attacks = table.get(blockers)
+    if attacks is None:
+        attacks = table[blockers] = slidingAttacks(square, blockers, BISHOP_DIRECTIONS)
+    return attacks
+
+
+def queenAttacks(square, occupied):
+    return rookAttacks(square, occupied) | bishopAttacks(square, occupied)
+
+
+'''
+Yields the square index of every set bit, lowest first
+'''
+def squaresOf(bitboard):
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+# A Move only depends on the two squares and the pieces standing on them, and nothing changes it once it is built,
+# so the generator builds each one once and hands out the same object at every later node.
+# Keyed by moved piece + captured piece ('--' for none), then by start * 64 + end. En passant captures are built directly,
+# their key would be that of a plain pawn capture. Its growth is bounded by the 64 * 64 square pairs of each key.
+MOVE_CACHE = {moved + captured: {} for moved in PIECES for captured in PIECES + ['--']}
+# The quiet moves of a piece as a whole: the same piece on the same square keeps coming back with the same quiet
+# target squares, so the tuple of their moves is kept per piece, keyed by target squares << 6 | start
+QUIET_MOVE_LISTS = {piece: {} for piece in PIECES}
+# The same for the pushes of all unpinned pawns at once, keyed by the push distance (its sign gives the color), then the end squares
+PAWN_PUSH_LISTS = {distance: {} for distance in (-16, -8, 8, 16)}
+# Target sets are arbitrary bitboards, so in a long game the two above would keep growing: each of their dictionaries
+# is emptied once it holds this many lists, which keeps them bounded and mostly filled with the current position's lists
+MOVE_LIST_CACHE_LIMIT = 4096
+
+
+'''
+Append the moves of piece from start to each square of ends, captures included, taking them from MOVE_CACHE
+'''
+def appendMoves(moves, piece, start, ends, enemy, board):
+    quiet = ends & ~enemy
+    if quiet:
+        quietMoves = QUIET_MOVE_LISTS[piece].get(quiet << 6 | start)
+        if quietMoves is None:
+            cache = MOVE_CACHE[piece + '--']
+            quietMoves = []
+            for end in squaresOf(quiet):
+                move = cache.get(start << 6 | end)
+                if move is None:
+                    move = cache[start << 6 | end] = Engine.Move(SQUARES[start], SQUARES[end], board)
+                quietMoves.append(move)
+            pieceLists = QUIET_MOVE_LISTS[piece]
+            if len(pieceLists) >= MOVE_LIST_CACHE_LIMIT:
+                pieceLists.clear()
+            quietMoves = pieceLists[quiet << 6 | start] = tuple(quietMoves)
+        moves.extend(quietMoves)
+    captures = ends & enemy
+    while captures:
+        lowest = captures & -captures
+        end = lowest.bit_length() - 1
+        endRow, endColumn = SQUARES[end]
+        cache = MOVE_CACHE[piece + board[endRow][endColumn]]
+        move = cache.get(start << 6 | end)
+        if move is None:
+            move = cache[start << 6 | end] = Engine.Move(SQUARES[start], SQUARES[end], board)
+        moves.append(move)
+        captures ^= lowest
+
+
+class GameState(Engine.GameState):
+    def __init__(self):
+        Engine.GameState.__init__(self)
+        self.pieceBitboards = {}
+        self.colorBitboards = {}
+        self.resetBitboards()
+
+    '''
+    Rebuild all bitboards from the 8x8 board. Call this after editing the board directly.
+    '''
+    def resetBitboards(self):
+        self.pieceBitboards = {piece: 0 for piece in PIECES}
+        self.colorBitboards = {'w': 0, 'b': 0}
+        for square, (row, column) in enumerate(SQUARES):
+            piece = self.board[row][column]
+            if piece != '--':
+                self.pieceBitboards[piece] |= 1 << square
+                self.colorBitboards[piece[0]] |= 1 << square
+
+    '''
+    Set up the position described by a FEN string and rebuild the bitboards for it
+    '''
+    def loadFEN(self, fen):
+        Engine.GameState.loadFEN(self, fen)
+        self.resetBitboards()
+
+    '''
+    Takes a Move as a parameter and executes it, keeping the bitboards in sync with the board
+    '''
+    def makeMove(self, move):
+        Engine.GameState.makeMove(self, move)
+        self.updateBitboards(move, self.board[move.endRow][move.endColumn])
+
+    '''
+    Undo the last move made, keeping the bitboards in sync with the board
+    '''
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            pieceLanded = self.board[move.endRow][move.endColumn]
+            Engine.GameState.undoMove(self)
+            self.updateBitboards(move, pieceLanded)
+
+    '''
+    Toggle the bits touched by a move. Applying it twice restores the original bitboards, so it serves makeMove and undoMove.
+    pieceLanded is the piece standing on the end square after the move (differs from pieceMoved on promotion)
+    '''
+    def updateBitboards(self, move, pieceLanded):
+        pieces = self.pieceBitboards
+        colors = self.colorBitboards
+        startBit = 1 << (move.startRow * 8 + move.startColumn)
+        endBit = 1 << (move.endRow * 8 + move.endColumn)
+        pieces[move.pieceMoved] ^= startBit
+        pieces[pieceLanded] ^= endBit
+        colors[move.pieceMoved[0]] ^= startBit | endBit
+        if move.pieceCaptured != '--':
+            captureBit = 1 << (move.startRow * 8 + move.endColumn) if move.isEnPassantMove else endBit
+            pieces[move.pieceCaptured] ^= captureBit
+            colors[move.pieceCaptured[0]] ^= captureBit
+        if move.isCastleMove:
+            rowOffset = move.endRow * 8
+            if move.endColumn - move.startColumn == 2:  # king side
+                rookBits = (1 << (rowOffset + 7)) | (1 << (rowOffset + 5))
+            else:  # queen side
+                rookBits = (1 << rowOffset) | (1 << (rowOffset + 3))
+            pieces[move.pieceMoved[0] + 'r'] ^= rookBits
+            colors[move.pieceMoved[0]] ^= rookBits
+
+    '''
+    Number of pieces on the board, kings included, from the occupancy instead of a scan of the board
+    '''
+    def getPieceCount(self):
+        return bin(self.colorBitboards['w'] | self.colorBitboards['b']).count('1')
+
+    '''
+    Whether any piece of the given color attacks square, with the given occupancy
+    '''
+    def isAttackedBy(self, square, color, occupied):
+        pieces = self.pieceBitboards
+        if KNIGHT_ATTACKS[square] & pieces[color + 'n']:
+            return True
+        if KING_ATTACKS[square] & pieces[color + 'k']:
+            return True
+        if PAWN_ATTACKS['b' if color == 'w' else 'w'][square] & pieces[color + 'p']:
+            return True
+        queens = pieces[color + 'q']
+        rooksAndQueens = pieces[color + 'r'] | queens
+        if rooksAndQueens and rookAttacks(square, occupied) & rooksAndQueens:
+            return True
+        bishopsAndQueens = pieces[color + 'b'] | queens
+        return bool(bishopsAndQueens and bishopAttacks(square, occupied) & bishopsAndQueens)
+
+    '''
+    Every square attacked by the pieces of the given color, with the given occupancy
+    '''
+    def attackedSquares(self, color, occupied):
+        pieces = self.pieceBitboards
+        attacks = KING_ATTACKS[pieces[color + 'k'].bit_length() - 1]
+        pawns = pieces[color + 'p']
+        if color == 'w':
+            attacks |= (pawns & ~COLUMN_MASKS[0]) >> 9 | (pawns & ~COLUMN_MASKS[7]) >> 7
+        else:
+            attacks |= ((pawns & ~COLUMN_MASKS[0]) << 7 | (pawns & ~COLUMN_MASKS[7]) << 9) & FULL_BOARD
+        queens = pieces[color + 'q']
+        for squares, attacksOf in ((pieces[color + 'n'], None), (pieces[color + 'r'] | queens, rookAttacks),
+                                   (pieces[color + 'b'] | queens, bishopAttacks)):
+            while squares:  # squaresOf inlined, this runs at every node
+                lowest = squares & -squares
+                square = lowest.bit_length() - 1
+                attacks |= attacksOf(square, occupied) if attacksOf else KNIGHT_ATTACKS[square]
+                squares ^= lowest
+        return attacks
+
+    '''
+    Check whether the enemy attacks the square at given row and column
+    '''
+    def squareUnderAttack(self, row, column):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.isAttackedBy(row * 8 + column, enemyColor, self.colorBitboards['w'] | self.colorBitboards['b'])
+
+    '''
+    Check whether the current player is in check
+    '''
+    def isInCheck(self):
+        allyColor = 'w' if self.whiteToMove else 'b'
+        return self.squareUnderAttack(*SQUARES[self.pieceBitboards[allyColor + 'k'].bit_length() - 1])
+
+    '''
+    All valid moves considering checks, generated from the bitboards with pin and check masks
+    With capturesOnly only the valid captures are generated and checkmate/stalemate are left False, as in Engine.GameState
+    '''
+    def getValidMoves(self, capturesOnly=False):
+        pieces = self.pieceBitboards
+        board = self.board
+        allyColor, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        ally = self.colorBitboards[allyColor]
+        enemy = self.colorBitboards[enemyColor]
+        occupied = ally | enemy
+        kingBit = pieces[allyColor + 'k']
+        kingSquare = kingBit.bit_length() - 1
+        kingRow, kingColumn = SQUARES[kingSquare]
+
+        # checks from knights and pawns can only be answered by capturing the checker
+        checkMask = (KNIGHT_ATTACKS[kingSquare] & pieces[enemyColor + 'n']) | \
+                    (PAWN_ATTACKS[allyColor][kingSquare] & pieces[enemyColor + 'p'])
+        checkCount = bin(checkMask).count('1')
+        # checks and pins from sliding pieces, traced outward from the king
+        pinMasks = {}
+        enemyQueens = pieces[enemyColor + 'q']
+        diagonalSliders = enemyQueens | pieces[enemyColor + 'b']
+        straightSliders = enemyQueens | pieces[enemyColor + 'r']
+        for lines, sliders in ((STRAIGHT_LINES, straightSliders if STRAIGHT_LINE_MASKS[kingSquare] & straightSliders else 0),
+                               (DIAGONAL_LINES, diagonalSliders if DIAGONAL_LINE_MASKS[kingSquare] & diagonalSliders else 0)):
+            if not sliders:  # nothing on these lines can check or pin
+                continue
+            for rays, positive in lines:
+                ray = rays[kingSquare]
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                first = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+                if sliders >> first & 1:
+                    checkMask |= ray ^ rays[first]  # the checker plus the squares in between
+                    checkCount += 1
+                elif ally >> first & 1:
+                    blockers ^= 1 << first
+                    second = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+                    if sliders >> second & 1:
+                        pinMasks[first] = ray ^ rays[second]
+
+        self.inCheck = checkCount > 0
+        moves = []
+        # king moves: the king must not stay on a ray it is sliding away from, so test with the king removed
+        occupiedWithoutKing = occupied ^ kingBit
+        allowed = enemy if capturesOnly else ~ally
+        attacked = self.attackedSquares(enemyColor, occupiedWithoutKing)
+        kingEnds = KING_ATTACKS[kingSquare] & allowed & ~attacked
+        if kingEnds:
+            appendMoves(moves, allyColor + 'k', kingSquare, kingEnds, enemy, board)
+
+        if checkCount < 2:  # under double check only the king can move
+            targets = allowed & (checkMask if checkCount else ~0)
+            self.getPieceMoves(allyColor, enemy, occupied, targets, pinMasks, moves)
+            self.getPawnBitboardMoves(allyColor, enemyColor, enemy, occupied, targets, pinMasks, kingSquare, moves, capturesOnly)
+            if not checkCount and not capturesOnly:
+                self.getCastleBitboardMoves(allyColor, occupied, kingRow, kingColumn, attacked, moves)
+
+        if len(moves) == 0 and not capturesOnly:  # either checkmate or stalemate
+            self.checkMate = self.inCheck
+            self.staleMate = not self.inCheck
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
+
+    '''
+    Knight, bishop, rook and queen moves restricted to the target squares and to the pin line of pinned pieces
+    '''
+    def getPieceMoves(self, allyColor, enemy, occupied, targets, pinMasks, moves):
+        pieces = self.pieceBitboards
+        board = self.board
+        knight = allyColor + 'n'
+        starts = pieces[knight]
+        while starts:  # squaresOf inlined, this runs at every node
+            lowest = starts & -starts
+            start = lowest.bit_length() - 1
+            starts ^= lowest
+            if start not in pinMasks:  # a pinned knight can never move
+                attacks = KNIGHT_ATTACKS[start] & targets
+                if attacks:
+                    appendMoves(moves, knight, start, attacks, enemy, board)
+        for piece, attacksOf in ((allyColor + 'b', bishopAttacks), (allyColor + 'r', rookAttacks), (allyColor + 'q', queenAttacks)):
+            starts = pieces[piece]
+            while starts:
+                lowest = starts & -starts
+                start = lowest.bit_length() - 1
+                starts ^= lowest
+                attacks = attacksOf(start, occupied) & targets
+                if start in pinMasks:
+                    attacks &= pinMasks[start]
+                if attacks:
+                    appendMoves(moves, piece, start, attacks, enemy, board)
+
+    '''
+    Pawn pushes, captures and en passant captures
+    '''
+    def getPawnBitboardMoves(self, allyColor, enemyColor, enemy, occupied, targets, pinMasks, kingSquare, moves, capturesOnly=False):
+        board = self.board
+        pawn = allyColor + 'p'
+        pawns = self.pieceBitboards[pawn]
+        empty = 0 if capturesOnly else ~occupied & FULL_BOARD  # no empty square to push to when only captures are wanted
+        # pinned pawns are handled one by one, all other pawns are shifted as a set
+        pinnedPawns = 0
+        for square in pinMasks:
+            pinnedPawns |= 1 << square
+        pinnedPawns &= pawns
+        freePawns = pawns ^ pinnedPawns
+        forward = -8 if allyColor == 'w' else 8
+        if allyColor == 'w':
+            singlePushes = freePawns >> 8 & empty
+            doublePushes = (singlePushes & ROW_MASKS[5]) >> 8 & empty
+            leftCaptures = (freePawns & ~COLUMN_MASKS[0]) >> 9 & enemy
+            rightCaptures = (freePawns & ~COLUMN_MASKS[7]) >> 7 & enemy
+        else:
+            singlePushes = freePawns << 8 & empty
+            doublePushes = (singlePushes & ROW_MASKS[2]) << 8 & empty
+            leftCaptures = (freePawns & ~COLUMN_MASKS[0]) << 7 & enemy
+            rightCaptures = (freePawns & ~COLUMN_MASKS[7]) << 9 & enemy
+        for targetSet, distance in ((singlePushes, forward), (doublePushes, 2 * forward)):
+            targetSet &= targets
+            if targetSet:
+                pushMoves = PAWN_PUSH_LISTS[distance].get(targetSet)
+                if pushMoves is None:
+                    cache = MOVE_CACHE[pawn + '--']
+                    pushMoves = []
+                    for end in squaresOf(targetSet):
+                        move = cache.get((end - distance) << 6 | end)
+                        if move is None:
+                            move = cache[(end - distance) << 6 | end] = Engine.Move(SQUARES[end - distance], SQUARES[end], board)
+                        pushMoves.append(move)
+                    pushLists = PAWN_PUSH_LISTS[distance]
+                    if len(pushLists) >= MOVE_LIST_CACHE_LIMIT:
+                        pushLists.clear()
+                    pushMoves = pushLists[targetSet] = tuple(pushMoves)
+                moves.extend(pushMoves)
+        for targetSet, distance in ((leftCaptures, forward - 1), (rightCaptures, forward + 1)):
+            targetSet &= targets
+            while targetSet:
+                lowest = targetSet & -targetSet
+                end = lowest.bit_length() - 1
+                start = end - distance
+                endRow, endColumn = SQUARES[end]
+                cache = MOVE_CACHE[pawn + board[endRow][endColumn]]
+                move = cache.get(start << 6 | end)
+                if move is None:
+                    move = cache[start << 6 | end] = Engine.Move(SQUARES[start], SQUARES[end], board)
+                moves.append(move)
+                targetSet ^= lowest
+
+        startRow = 6 if allyColor == 'w' else 1
+        pawnAttacks = PAWN_ATTACKS[allyColor]
+        for start in squaresOf(pinnedPawns):
+            allowed = targets & pinMasks[start]
+            ends = pawnAttacks[start] & enemy
+            push = start + forward
+            if empty >> push & 1:
+                ends |= 1 << push
+                doublePush = push + forward
+                if SQUARES[start][0] == startRow and empty >> doublePush & 1:
+                    ends |= 1 << doublePush
+            appendMoves(moves, pawn, start, ends & allowed, enemy, board)
+
+        if self.enPassantPossible != ():
+            endRow, endColumn = self.enPassantPossible
+            end = endRow * 8 + endColumn
+            captured = end - forward
+            for start in squaresOf(PAWN_ATTACKS[enemyColor][end] & pawns):
+                # play the capture on the occupancy and look for a slider hitting the king, which covers every pin case
+                occupiedAfter = occupied ^ (1 << start) ^ (1 << captured) | (1 << end)
+                enemyPieces = self.pieceBitboards
+                queens = enemyPieces[enemyColor + 'q']
+                if rookAttacks(kingSquare, occupiedAfter) & (enemyPieces[enemyColor + 'r'] | queens):
+                    continue
+                if bishopAttacks(kingSquare, occupiedAfter) & (enemyPieces[enemyColor + 'b'] | queens):
+                    continue
+                if (KNIGHT_ATTACKS[kingSquare] & enemyPieces[enemyColor + 'n']) or \
+                        (PAWN_ATTACKS[allyColor][kingSquare] & enemyPieces[enemyColor + 'p'] & ~(1 << captured)):
+                    continue
+                moves.append(Engine.Move(SQUARES[start], SQUARES[end], board, isEnPassantMove=True))
+
+    '''
+    Castle moves for a king that is not in check, attacked being the squares the enemy attacks. getValidMoves works
+    those out with the king lifted off the board, which changes nothing here since no slider reaches a king not in check.
+    '''
+    def getCastleBitboardMoves(self, allyColor, occupied, kingRow, kingColumn, attacked, moves):
+        rights = self.currentCastlingRight
+        if allyColor == 'w':
+            kingSide, queenSide = rights.whiteKingSide, rights.whiteQueenSide
+        else:
+            kingSide, queenSide = rights.blackKingSide, rights.blackQueenSide
+        rowOffset = kingRow * 8
+        start = rowOffset + kingColumn
+        cache = MOVE_CACHE[allyColor + 'k--']  # no plain king move goes two squares, so castling can share the king's moves
+        if kingSide and not (occupied | attacked) & (0b11 << (rowOffset + 5)):
+            move = cache.get(start << 6 | (start + 2))
+            if move is None:
+                move = cache[start << 6 | (start + 2)] = \
+                    Engine.Move((kingRow, kingColumn), (kingRow, kingColumn + 2), self.board, isCastleMove=True)
+            moves.append(move)
+        if queenSide and not occupied & (0b111 << (rowOffset + 1)) and not attacked & (0b11 << (rowOffset + 2)):
+            move = cache.get(start << 6 | (start - 2))
+            if move is None:
+                move = cache[start << 6 | (start - 2)] = \
+                    Engine.Move((kingRow, kingColumn), (kingRow, kingColumn - 2), self.board, isCastleMove=True)
+            moves.append(move)
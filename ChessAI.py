@@ -1,9 +1,120 @@
+import multiprocessing
+import os
 import random
+import time
+import OpeningBook
+import Tablebase
+from PieceSquareTables import phaseWeight
 
-pieceScore = {'k': 0, 'q': 9, 'r': 5, 'b': 3, 'n': 3, 'p': 1}
-CHECKMATE = 1000
+pieceScore = {'k': 0, 'q': 900, 'r': 500, 'b': 330, 'n': 320, 'p': 100}  # centipawns, like GameState.getEvaluation
+CHECKMATE = 100000
 STALEMATE = 0
 DEPTH = 3
+SEARCH_TIME_MS = 500  # default wall-clock budget of findBestMove
+MAX_DEPTH = 32  # iterative deepening stops here even if time is left
+TIME_CHECK_INTERVAL = 256  # nodes between two looks at the clock
+TT_SIZE_MB = 16  # memory cap of the transposition table
+TT_ENTRY_BYTES = 160  # approximate size of one stored entry tuple, its key and the list slot pointing to it
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2  # how a stored score relates to the true score of the position
+# move ordering: hash move, then captures by most valuable victim / least valuable attacker, then killers, then history
+orderValue = {'k': 10, 'q': 9, 'r': 5, 'b': 3, 'n': 3, 'p': 1}
+HASH_MOVE_ORDER = 1000000
+CAPTURE_ORDER = 100000
+KILLER_ORDER = (90000, 80000)  # first and second killer
+HISTORY_LIMIT = 50000  # history scores are halved once one passes this, so they stay below the killers
+DELTA_MARGIN = 200  # quiescence skips captures that can't lift the score to alpha even with this much extra (centipawns)
+NO_KILLERS = (None, None)
+# selective search, both parts can be switched off to compare against the full-width search (SearchBenchmark.py)
+NULL_MOVE_PRUNING = True
+NULL_MOVE_REDUCTION = 2  # plies the null move is searched shallower than a real move would be
+NULL_MOVE_DEEP_REDUCTION = 3  # the same from NULL_MOVE_DEEP_DEPTH on
+NULL_MOVE_DEEP_DEPTH = 6
+NULL_MOVE_MIN_DEPTH = 2  # remaining depth from which a null move is tried
+NULL_MOVE_MIN_PHASE = 2  # pieces the side to move needs for a null move, in phase weight: a rook or two minor pieces
+LATE_MOVE_REDUCTIONS = True
+LMR_MIN_DEPTH = 2  # remaining depth from which late quiet moves are reduced
+LMR_FULL_DEPTH_MOVES = 3  # moves searched at full depth before the reductions start
+LMR_REDUCTION = 1
+LMR_DEEP_MOVES = 6  # moves from this one on are reduced by one ply more
+# zero-window searches for all but the first move and aspiration windows at the root, switchable like the above
+PRINCIPAL_VARIATION_SEARCH = True
+ASPIRATION_WINDOWS = True
+ASPIRATION_WINDOW = 50  # iterations from ASPIRATION_MIN_DEPTH on search this far around the previous score first
+ASPIRATION_MIN_DEPTH = 3
+USE_OPENING_BOOK = True  # play from OpeningBook.BOOK_PATH while the position is in it
+USE_TABLEBASES = True  # probe the files in Tablebase.TABLEBASE_DIRECTORY at the root and in the search
+TABLEBASE_WIN = CHECKMATE // 2  # score of a tablebase win less its plies to mate: below the search's mates, above any evaluation
+TABLEBASE_MAX_PHASE = 2 * phaseWeight['q']  # no position of Tablebase.MAX_PIECES pieces has more, a cheap test before counting
+# the switches and tuning of the search above, handed to the findBestMoveParallel workers with every job: spawned
+# workers import this module afresh and would otherwise search with the defaults whatever the caller changed
+SEARCH_SETTINGS = ('DELTA_MARGIN', 'NULL_MOVE_PRUNING', 'NULL_MOVE_REDUCTION', 'NULL_MOVE_DEEP_REDUCTION',
+                   'NULL_MOVE_DEEP_DEPTH', 'NULL_MOVE_MIN_DEPTH', 'NULL_MOVE_MIN_PHASE', 'LATE_MOVE_REDUCTIONS',
+                   'LMR_MIN_DEPTH', 'LMR_FULL_DEPTH_MOVES', 'LMR_REDUCTION', 'LMR_DEEP_MOVES', 'PRINCIPAL_VARIATION_SEARCH',
+                   'ASPIRATION_WINDOWS', 'ASPIRATION_WINDOW', 'ASPIRATION_MIN_DEPTH', 'USE_OPENING_BOOK', 'USE_TABLEBASES')
+
+
+class TranspositionTable:
+    '''
+    Fixed-size table of search results keyed by GameState.zobristKey. Every bucket has two slots:
+    a depth-preferred slot that keeps the deepest result of the current search and an always-replace slot for the rest.
+    Entries are tuples (key, depth, score, bound, bestMoveID, generation).
+    '''
+    def __init__(self, sizeMB=TT_SIZE_MB):
+        self.bucketCount = max(1, sizeMB * 1024 * 1024 // (2 * TT_ENTRY_BYTES))
+        self.depthPreferred = [None] * self.bucketCount
+        self.alwaysReplace = [None] * self.bucketCount
+        self.generation = 0  # entries from older searches may always be replaced
+
+    def clear(self):
+        self.depthPreferred = [None] * self.bucketCount
+        self.alwaysReplace = [None] * self.bucketCount
+
+    '''
+    Called once per findBestMove, so results of earlier moves stay usable but give way to new ones
+    '''
+    def newSearch(self):
+        self.generation += 1
+
+    def probe(self, key):
+        index = key % self.bucketCount
+        entry = self.depthPreferred[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.alwaysReplace[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, bestMoveID):
+        index = key % self.bucketCount
+        entry = (key, depth, score, bound, bestMoveID, self.generation)
+        current = self.depthPreferred[index]
+        if current is None or current[0] == key or depth >= current[1] or current[5] != self.generation:
+            self.depthPreferred[index] = entry
+        else:
+            self.alwaysReplace[index] = entry
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+transpositionTable = TranspositionTable()  # kept between moves so each search reuses the work of the previous ones
+nodeCount = 0  # nodes visited by the last findBestMove, for benchmarks
+completedDepth = 0  # depth of the last finished iteration of the last findBestMove
+principalVariation = []  # moves the last finished iteration expects to be played, the best move first
+rootBestMoveID = None  # best move of the last finished iteration, the hash move of the root (which is never stored)
+rootDepth = DEPTH  # depth of the iteration in progress, the root node is the one searched at this depth
+deadline = None  # time.perf_counter() value at which the search gives up, None for no time limit
+nodeLimit = None
+stopRequested = False  # set from another thread to abort the running search as soon as possible, even at depth 1
+killerMoves = [[None, None] for ply in range(MAX_DEPTH + 1)]  # moveIDs of the last two quiet moves that caused a cutoff at each ply
+historyTable = {}  # moveID -> how much the quiet move has caused cutoffs, weighted by depth
+searchPool = None  # worker processes of findBestMoveParallel, started by its first call
+searchPoolSize = 0
+openingBook = None  # OpeningBook.OpeningBook, opened by the first lookup that finds the book file
+tablebases = None  # Tablebase.Tablebases, opened by the first probe
+moveSource = 'search'  # where the last findBestMove got its move: 'search', 'book' or 'tablebase'
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves)-1)]
@@ -42,17 +153,278 @@ def findRandomMove(validMoves):
 
 
 '''
-Helper method to make recursive call for negamax algorithm with alpha-beta pruning
+Iterative deepening over negamax with alpha-beta pruning. Searches depth 1, 2, 3, ... until the time or node budget runs out
+and returns the best move of the last completed iteration. Depth 1 always completes so there is always a move to play.
+Each iteration tries the previous best move first (rootBestMoveID), and the transposition table orders the rest of
+the previous principal variation.
+The principal variation of the returned move is left in principalVariation. A book move is played without a search,
+and so is the best move of a position in the tablebases.
 '''
-def findBestMove(gameState, validMoves):
+def findBestMove(gameState, validMoves, timeMs=SEARCH_TIME_MS, nodeBudget=None, maxDepth=MAX_DEPTH):
     global nextMove
-    nextMove = None
-    random.shuffle(validMoves)
-    # findMoveMinMax(gameState, validMoves, DEPTH, gameState.whiteToMove)
-    findMoveNegaMaxAlphaBeta(gameState, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gameState.whiteToMove else -1)
+    knownMove = findBookMove(gameState, validMoves) or findTablebaseMove(gameState, validMoves)
+    if knownMove is not None:
+        return knownMove
+    bestMove = None
+    for depth, score, bestMove in iterativeDeepening(gameState, validMoves, timeMs, nodeBudget, maxDepth):
+        if abs(score) >= CHECKMATE or len(validMoves) == 1:  # a forced mate or a forced move will not change with depth
+            break
+    nextMove = bestMove
+    return bestMove
+
+
+'''
+Generator behind findBestMove: yields (depth, score, best move) after every completed iteration, the score from
+the point of view of the side to move. Stops when the budget runs out; the caller may stop it earlier.
+'''
+def iterativeDeepening(gameState, validMoves, timeMs, nodeBudget, maxDepth):
+    global nextMove, nodeCount, completedDepth, principalVariation, rootDepth, deadline, nodeLimit, moveSource, rootBestMoveID
+    moveSource = 'search'
+    nodeCount = 0
+    completedDepth = 0
+    principalVariation = []
+    rootBestMoveID = None
+    validMoves = list(validMoves)
+    random.shuffle(validMoves)  # the ordering sort is stable, so this only breaks ties between equal moves
+    transpositionTable.newSearch()
+    for killers in killerMoves:
+        killers[0] = killers[1] = None
+    historyTable.clear()
+    startTime = time.perf_counter()
+    movesMade = len(gameState.moveLog)
+    nullMovesMade = len(gameState.nullMoveLog)
+    turnMultiplier = 1 if gameState.whiteToMove else -1
+    score = 0
+    try:
+        for depth in range(1, maxDepth + 1):
+            rootDepth = depth
+            # the first iteration runs without limits
+            deadline = startTime + timeMs / 1000 if timeMs is not None and depth > 1 else None
+            nodeLimit = nodeBudget if depth > 1 else None
+            # aspiration window: expect the score of the previous iteration, and widen the side that fails
+            window = ASPIRATION_WINDOW
+            if ASPIRATION_WINDOWS and depth >= ASPIRATION_MIN_DEPTH and abs(score) < CHECKMATE:
+                alpha, beta = max(score - window, -CHECKMATE), min(score + window, CHECKMATE)
+            else:
+                alpha, beta = -CHECKMATE, CHECKMATE
+            try:
+                while True:
+                    nextMove = None
+                    score = findMoveNegaMaxAlphaBeta(gameState, validMoves, depth, alpha, beta, turnMultiplier)
+                    window *= 4
+                    if score <= alpha and alpha > -CHECKMATE:
+                        alpha = max(score - window, -CHECKMATE)
+                    elif score >= beta and beta < CHECKMATE:
+                        beta = min(score + window, CHECKMATE)
+                    else:
+                        break
+            except SearchTimeout:
+                # unwind the moves the aborted search left on the board, null moves included
+                while len(gameState.moveLog) > movesMade or len(gameState.nullMoveLog) > nullMovesMade:
+                    if len(gameState.nullMoveLog) > nullMovesMade and gameState.nullMoveLog[-1] == len(gameState.moveLog):
+                        gameState.undoNullMove()
+                    else:
+                        gameState.undoMove()
+                return
+            completedDepth = depth
+            principalVariation = getPrincipalVariation(gameState, nextMove, depth)
+            if nextMove is not None:
+                rootBestMoveID = nextMove.moveID
+            yield depth, score, nextMove
+    finally:
+        deadline = nodeLimit = None
+
+
+'''
+Root-parallel search: the root moves are dealt out over a pool of worker processes, each of which runs
+iterative deepening on its own copy of the GameState and its share of the moves with the full time budget.
+Returns the best move at the deepest iteration every worker completed (a worker that proved a mate counts as
+complete at any depth), and leaves nodeCount, completedDepth and principalVariation as findBestMove does.
+'''
+def findBestMoveParallel(gameState, validMoves, timeMs=SEARCH_TIME_MS, nodeBudget=None, maxDepth=MAX_DEPTH, processes=None):
+    global nextMove, nodeCount, completedDepth, principalVariation, searchPool, searchPoolSize, moveSource
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1 or len(validMoves) < 2:  # findBestMove looks in the book and the tablebases itself
+        return findBestMove(gameState, validMoves, timeMs, nodeBudget, maxDepth)
+    knownMove = findBookMove(gameState, validMoves) or findTablebaseMove(gameState, validMoves)
+    if knownMove is not None:
+        return knownMove
+    if searchPoolSize != processes:
+        shutdownSearchPool()
+        # spawned on every platform, so the workers behave the same everywhere and get their settings only from the jobs
+        searchPool = multiprocessing.get_context('spawn').Pool(processes)
+        searchPoolSize = processes
+    # deal the moves out in order, so every worker gets a share of the promising captures and of the quiet moves.
+    # The history of an earlier search in this process has nothing to do with this position, so only MVV-LVA orders them
+    historyTable.clear()
+    moves = list(validMoves)
+    orderMoves(moves, None, NO_KILLERS)
+    workerBudget = nodeBudget // processes if nodeBudget is not None else None
+    settings = {name: globals()[name] for name in SEARCH_SETTINGS}
+    jobs = [searchPool.apply_async(searchRootMoves, (gameState, [move.moveID for move in moves[i::processes]],
+                                                     timeMs, workerBudget, maxDepth, settings, random.getrandbits(32)))
+            for i in range(min(processes, len(moves)))]
+    results = [job.get() for job in jobs]
+    nodeCount = sum(workerNodes for iterations, workerNodes in results)
+    moveSource = 'search'
+    unfinished = [iterations[-1][0] for iterations, workerNodes in results
+                  if abs(iterations[-1][1]) < CHECKMATE and iterations[-1][0] < maxDepth]
+    completedDepth = min(unfinished) if unfinished else max(iterations[-1][0] for iterations, workerNodes in results)
+    bestScore = None
+    bestVariation = None
+    for iterations, workerNodes in results:
+        depth, score, variation = [iteration for iteration in iterations if iteration[0] <= completedDepth][-1] \
+            if abs(iterations[-1][1]) < CHECKMATE else iterations[-1]
+        if variation and (bestScore is None or score > bestScore):
+            bestScore, bestVariation = score, variation
+    if bestVariation is None:  # no worker found a move to play
+        nextMove = None
+        principalVariation = []
+        return None
+    nextMove = next(move for move in validMoves if move.moveID == bestVariation[0])
+    principalVariation = movesFromIDs(gameState, bestVariation)
     return nextMove
 
 
+'''
+Stop the worker processes of findBestMoveParallel, if it started any. The next call starts new ones
+'''
+def shutdownSearchPool():
+    global searchPool, searchPoolSize
+    if searchPool is not None:
+        searchPool.terminate()
+        searchPool.join()
+    searchPool = None
+    searchPoolSize = 0
+
+
+'''
+A move from the opening book, chosen at random by the weights of the book entries, or None if the book is off,
+there is no book file or the position is not in it. Sets nextMove, principalVariation and the counters like a search
+'''
+def findBookMove(gameState, validMoves):
+    global nextMove, nodeCount, completedDepth, principalVariation, openingBook, moveSource
+    if not USE_OPENING_BOOK:
+        return None
+    if openingBook is None:
+        if not os.path.exists(OpeningBook.BOOK_PATH):
+            return None
+        openingBook = OpeningBook.OpeningBook(OpeningBook.BOOK_PATH)
+    bookMove = openingBook.findMove(gameState, validMoves)
+    if bookMove is not None:
+        nextMove = bookMove
+        nodeCount = completedDepth = 0
+        principalVariation = [bookMove]
+        moveSource = 'book'
+    return bookMove
+
+
+'''
+The move to the best tablebase result (the quickest mate, a draw or the slowest loss), or None if the tablebases are off
+or the position or one of its children is not in them. Sets nextMove, principalVariation and the counters like a search
+'''
+def findTablebaseMove(gameState, validMoves):
+    global nextMove, nodeCount, completedDepth, principalVariation, moveSource
+    if probeTablebases(gameState) is None:
+        return None
+    bestMove = bestValue = None
+    for move in validMoves:
+        gameState.makeMove(move)
+        childValue = probeTablebases(gameState)
+        gameState.undoMove()
+        if childValue is None:  # a capture or promotion into a missing table, or a double push open to en passant
+            return None
+        value = Tablebase.parentValue(childValue)
+        if bestMove is None or Tablebase.valueRank(value) > Tablebase.valueRank(bestValue):
+            bestMove, bestValue = move, value
+    if bestMove is not None:
+        nextMove = bestMove
+        nodeCount = completedDepth = 0
+        principalVariation = [bestMove]
+        moveSource = 'tablebase'
+    return bestMove
+
+
+'''
+Tablebase value of the position (see Tablebase), or None if the tablebases are off or do not have it.
+Counting the pieces is cheap next to the probe, so it goes first
+'''
+def probeTablebases(gameState):
+    global tablebases
+    if not USE_TABLEBASES or gameState.getPieceCount() > Tablebase.MAX_PIECES:
+        return None
+    if tablebases is None:
+        tablebases = Tablebase.Tablebases(Tablebase.TABLEBASE_DIRECTORY)
+    return tablebases.probe(gameState)
+
+
+'''
+Search score of a tablebase value for the side to move, quicker wins and slower losses scoring higher
+'''
+def tablebaseScore(value):
+    if value > 0:
+        return TABLEBASE_WIN - value
+    if value < 0:
+        return -TABLEBASE_WIN - value - 1
+    return STALEMATE
+
+
+'''
+Work of one findBestMoveParallel worker: iterative deepening restricted to the given root moves, with the caller's
+SEARCH_SETTINGS and a shuffle seeded from the caller's random. Returns the (depth, score, moveIDs of the principal
+variation) of every completed iteration and the number of nodes searched.
+'''
+def searchRootMoves(gameState, rootMoveIDs, timeMs, nodeBudget, maxDepth, settings, seed):
+    globals().update(settings)
+    random.seed(seed)
+    validMoves = [move for move in gameState.getValidMoves() if move.moveID in rootMoveIDs]
+    iterations = []
+    for depth, score, move in iterativeDeepening(gameState, validMoves, timeMs, nodeBudget, maxDepth):
+        iterations.append((depth, score, [variationMove.moveID for variationMove in principalVariation]))
+        if abs(score) >= CHECKMATE:
+            break
+    return iterations, nodeCount
+
+
+'''
+The best move followed by the best moves of exact transposition table entries, at most length moves.
+Stops at a bound, a missing entry or a repeated position. Empty if there is no best move
+'''
+def getPrincipalVariation(gameState, bestMove, length):
+    if bestMove is None:
+        return []
+    variation = [bestMove]
+    seenKeys = set()
+    gameState.makeMove(bestMove)
+    while len(variation) < length and gameState.zobristKey not in seenKeys:
+        seenKeys.add(gameState.zobristKey)
+        entry = transpositionTable.probe(gameState.zobristKey)
+        if entry is None or entry[3] != EXACT or entry[4] is None:
+            break
+        move = next((move for move in gameState.getValidMoves() if move.moveID == entry[4]), None)
+        if move is None:
+            break
+        gameState.makeMove(move)
+        variation.append(move)
+    for move in variation:
+        gameState.undoMove()
+    return variation
+
+
+'''
+Turn a line of moveIDs from the given position back into moves
+'''
+def movesFromIDs(gameState, moveIDs):
+    moves = []
+    for moveID in moveIDs:
+        move = next(move for move in gameState.getValidMoves() if move.moveID == moveID)
+        gameState.makeMove(move)
+        moves.append(move)
+    for move in moves:
+        gameState.undoMove()
+    return moves
+
+
 def findMoveMinMax(gameState, validMoves, depth, whiteToMove):
     global nextMove
     if depth == 0:
@@ -102,28 +474,215 @@ def findMoveNegaMax(gameState, validMoves, depth, turnMultiplier):
     return maxScore
 
 
-def findMoveNegaMaxAlphaBeta(gameState, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
+'''
+Negamax with alpha-beta pruning and a transposition table, as a principal variation search: the first move gets the
+full window, the others only have to be proven worse with a zero window and are searched again if that fails high.
+Two kinds of selectivity: null-move pruning below the root (if passing the turn still fails high, so will a real move)
+and late-move reductions (quiet moves ordered late are searched shallower, and again at full depth if they beat alpha).
+allowNullMove is False right after a null move, so there are never two in a row. ply is the distance from the root,
+which the reductions keep apart from the remaining depth, and indexes the killer moves.
+'''
+def findMoveNegaMaxAlphaBeta(gameState, validMoves, depth, alpha, beta, turnMultiplier, allowNullMove=True, ply=0):
+    global nextMove, nodeCount
+    nodeCount += 1
+    if nodeCount % TIME_CHECK_INTERVAL == 0:
+        checkSearchLimits()
+    # the tablebases know the exact result of the positions they have, so those are not searched (the root needs a move)
+    if USE_TABLEBASES and gameState.phase <= TABLEBASE_MAX_PHASE and depth != rootDepth:
+        value = probeTablebases(gameState)
+        if value is not None:
+            return tablebaseScore(value)
+    # worked out here rather than read from gameState.inCheck: a re-search reuses the move list of this position,
+    # and by then the flags getValidMoves set belong to whatever position the first search generated moves for last
+    inCheck = gameState.isInCheck()
+    if not validMoves:
+        return -CHECKMATE if inCheck else STALEMATE
     if depth == 0:
-        return turnMultiplier * scoreBoard(gameState)
+        return findMoveQuiescence(gameState, validMoves, alpha, beta, turnMultiplier, inCheck)
+
+    # reuse a stored result if it was searched at least as deep, otherwise just try its best move first.
+    # The root is never stored, its hash move is the best move of the previous iteration
+    key = gameState.zobristKey
+    originalAlpha = alpha
+    isRoot = depth == rootDepth
+    hashMoveID = rootBestMoveID if isRoot else None
+    entry = transpositionTable.probe(key) if not isRoot else None
+    if entry is not None:
+        entryDepth, entryScore, entryBound, hashMoveID = entry[1], entry[2], entry[3], entry[4]
+        if entryDepth >= depth:
+            if entryBound == EXACT or \
+                    (entryBound == LOWERBOUND and entryScore >= beta) or \
+                    (entryBound == UPPERBOUND and entryScore <= alpha):
+                return entryScore
+
+    # null-move pruning, not in check (passing would be illegal) and not with few pieces, where zugzwang is common
+    if NULL_MOVE_PRUNING and allowNullMove and not isRoot and depth >= NULL_MOVE_MIN_DEPTH and not inCheck and \
+            validMoves and abs(beta) < CHECKMATE and turnMultiplier * scoreBoard(gameState) >= beta and \
+            hasNullMoveMaterial(gameState):
+        gameState.makeNullMove()
+        nextMoves = gameState.getValidMoves()
+        reduction = NULL_MOVE_DEEP_REDUCTION if depth >= NULL_MOVE_DEEP_DEPTH else NULL_MOVE_REDUCTION
+        score = -findMoveNegaMaxAlphaBeta(gameState, nextMoves, max(0, depth - 1 - reduction), -beta, -beta + 1,
+                                          -turnMultiplier, False, ply + 1)
+        gameState.undoNullMove()
+        if score >= beta:
+            return beta if score >= CHECKMATE else score  # a mate found after passing is not proven
+
+    killers = killerMoves[ply]
+    orderMoves(validMoves, hashMoveID, killers)
+    reduceLateMoves = LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and not inCheck
 
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMove = None
+    for moveIndex, move in enumerate(validMoves):
         gameState.makeMove(move)
         nextMoves = gameState.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gameState, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
+        reduction = 0
+        if reduceLateMoves and moveIndex >= LMR_FULL_DEPTH_MOVES and move.pieceCaptured == '--' and \
+                not move.isPawnPromotion and not gameState.inCheck and move.moveID not in killers:
+            # the root reduces by one ply at most, or quiet mates like a rook sacrifice are found a ply later
+            reduction = LMR_REDUCTION + 1 if moveIndex >= LMR_DEEP_MOVES and not isRoot else LMR_REDUCTION
+        if moveIndex == 0 or not (reduction or PRINCIPAL_VARIATION_SEARCH):
+            score = -findMoveNegaMaxAlphaBeta(gameState, nextMoves, depth-1, -beta, -alpha, -turnMultiplier, ply=ply + 1)
+        else:
+            score = -findMoveNegaMaxAlphaBeta(gameState, nextMoves, max(0, depth - 1 - reduction), -alpha - 1, -alpha,
+                                              -turnMultiplier, ply=ply + 1)
+            # a reduced move that beats alpha is searched again at full depth, any move that lands inside the window
+            # with the full window to get its exact score
+            if alpha < score and (reduction or score < beta):
+                score = -findMoveNegaMaxAlphaBeta(gameState, nextMoves, depth-1, -beta, -alpha, -turnMultiplier,
+                                                  ply=ply + 1)
+        if score > maxScore or bestMove is None:  # when every move gets mated, the first one is still a move to play
             maxScore = score
-            if depth == DEPTH:
+            bestMove = move
+            if depth == rootDepth:
                 nextMove = move
         gameState.undoMove()
         if maxScore > alpha:
             alpha = maxScore
         if alpha >= beta:
+            if move.pieceCaptured == '--' and not move.isPawnPromotion:  # remember quiet refutations
+                updateKillersAndHistory(move.moveID, killers, depth)
             break
+
+    if isRoot:  # the root may be searching only some of its moves (searchRootMoves), so it is not stored
+        return maxScore
+    if maxScore <= originalAlpha:
+        bound = UPPERBOUND
+    elif maxScore >= beta:
+        bound = LOWERBOUND
+    else:
+        bound = EXACT
+    transpositionTable.store(key, depth, maxScore, bound, bestMove.moveID if bestMove is not None else None)
     return maxScore
 
 
+'''
+Capture-only search at the leaves, so a position is never scored in the middle of an exchange.
+The side to move may stand pat on the static score unless it is in check; in check every evasion is searched.
+inCheck is passed in by the caller, which has just generated validMoves for this position
+'''
+def findMoveQuiescence(gameState, validMoves, alpha, beta, turnMultiplier, inCheck):
+    global nodeCount
+    nodeCount += 1
+    if nodeCount % TIME_CHECK_INTERVAL == 0:
+        checkSearchLimits()
+    if inCheck and not validMoves:  # in check validMoves holds every evasion, so this is mate
+        return -CHECKMATE
+
+    if inCheck:
+        maxScore = -CHECKMATE
+        standPat = None
+    else:
+        standPat = turnMultiplier * scoreBoard(gameState)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        maxScore = standPat
+        validMoves = [move for move in validMoves if move.pieceCaptured != '--']
+    orderMoves(validMoves, None, NO_KILLERS)
+
+    for move in validMoves:
+        # delta pruning: even winning the captured piece for free would not reach alpha
+        if standPat is not None and standPat + pieceScore[move.pieceCaptured[1]] + DELTA_MARGIN <= alpha:
+            continue
+        gameState.makeMove(move)
+        nextMoves = gameState.getValidMoves(capturesOnly=True)
+        childInCheck = gameState.inCheck  # set by the generation just above
+        if childInCheck:  # a check has to be answered by any evasion, not just captures
+            nextMoves = gameState.getValidMoves()
+        score = -findMoveQuiescence(gameState, nextMoves, -beta, -alpha, -turnMultiplier, childInCheck)
+        gameState.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+
+'''
+Whether the side to move has at least NULL_MOVE_MIN_PHASE worth of pieces. Below that null-move pruning is unsafe:
+in pawn endings, and often with a lone minor piece, being forced to move is what loses
+'''
+def hasNullMoveMaterial(gameState):
+    color = 'w' if gameState.whiteToMove else 'b'
+    phase = 0
+    for row in gameState.board:
+        for square in row:
+            if square[0] == color:
+                phase += phaseWeight[square[1]]
+                if phase >= NULL_MOVE_MIN_PHASE:
+                    return True
+    return False
+
+
+'''
+Raise SearchTimeout once the time or node budget of the running search is spent or a stop was requested
+'''
+def checkSearchLimits():
+    if stopRequested or (deadline is not None and time.perf_counter() > deadline) or \
+            (nodeLimit is not None and nodeCount > nodeLimit):
+        raise SearchTimeout()
+
+
+'''
+Sort the moves in place, best candidates first. The sort is stable, so equal moves keep their order
+'''
+def orderMoves(moves, hashMoveID, killers):
+    moves.sort(key=lambda move: moveOrderScore(move, hashMoveID, killers), reverse=True)
+
+
+def moveOrderScore(move, hashMoveID, killers):
+    if move.moveID == hashMoveID:
+        return HASH_MOVE_ORDER
+    if move.pieceCaptured != '--':
+        return CAPTURE_ORDER + 10 * orderValue[move.pieceCaptured[1]] - orderValue[move.pieceMoved[1]]
+    if move.isPawnPromotion:
+        return CAPTURE_ORDER + 10 * orderValue['q'] - orderValue['p']
+    if move.moveID == killers[0]:
+        return KILLER_ORDER[0]
+    if move.moveID == killers[1]:
+        return KILLER_ORDER[1]
+    return historyTable.get(move.moveID, 0)
+
+
+'''
+Record a quiet move that caused a beta cutoff
+'''
+def updateKillersAndHistory(moveID, killers, depth):
+    if killers[0] != moveID:
+        killers[1] = killers[0]
+        killers[0] = moveID
+    score = historyTable.get(moveID, 0) + depth * depth
+    historyTable[moveID] = score
+    if score > HISTORY_LIMIT:
+        for historyMoveID in historyTable:
+            historyTable[historyMoveID] //= 2
+
+
 def scoreBoard(gameState):
     if gameState.checkMate:
         if gameState.whiteToMove:
@@ -133,15 +692,7 @@ def scoreBoard(gameState):
     elif gameState.staleMate:
         return STALEMATE  # draw
 
-    score = 0
-    for row in gameState.board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScore[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScore[square[1]]
-
-    return score
+    return gameState.getEvaluation()  # material and piece-square tables, kept up to date by makeMove and undoMove
 
 
 '''
@@ -2,6 +2,18 @@
 This file is responsible for storing all the information about the current state of a chess game.
 It will also be responsible for determining the valid moves at the current state and also keep a move log.
 """
+import random
+from PieceSquareTables import MIDDLEGAME_SCORES, ENDGAME_SCORES, phaseWeight, TOTAL_PHASE
+
+# Zobrist keys: one random 64-bit number per (piece, square), side to move, castle rights combination and en passant column.
+# The generator is seeded so every process computes the same key for the same position.
+_zobristRandom = random.Random(20231)
+ZOBRIST_PIECES = {color + piece: [_zobristRandom.getrandbits(64) for square in range(64)] for color in 'wb' for piece in 'pnbrqk'}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for rights in range(16)]
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for column in range(8)]
+DEBUG_ZOBRIST = False  # when True, makeMove and undoMove check the incremental key against a full recompute
+DEBUG_EVALUATION = False  # when True, makeMove and undoMove check the incremental evaluation against a full recompute
 
 
 class GameState:
@@ -31,16 +43,149 @@ class GameState:
         self.checks = []
         self.checkMate = False
         self.staleMate = False
+        self.capturesOnly = False  # set while getValidMoves generates captures only, so the move functions skip quiet moves
         self.enPassantPossible = ()  # coordinates of the square where en Passant capture is possible
         self.enPassantPossibleLog = [self.enPassantPossible]
         self.currentCastlingRight = CastleRights(True, True, True, True)
         self.castleRightsLog = [CastleRights(self.currentCastlingRight.whiteKingSide, self.currentCastlingRight.blackKingSide,
                                              self.currentCastlingRight.whiteQueenSide, self.currentCastlingRight.blackQueenSide)]
+        self.zobristKey = self.computeZobristKey()  # 64-bit hash of the position, updated incrementally
+        self.zobristKeyLog = [self.zobristKey]
+        # material plus piece-square scores for the middlegame and the endgame, and the game phase, updated incrementally
+        self.middlegameScore, self.endgameScore, self.phase = self.computeEvaluationState()
+        self.evaluationLog = [(self.middlegameScore, self.endgameScore, self.phase)]
+        # halfmove clock and ply number (0 = white's first move) of the position the move log starts from, for getFEN
+        self.initialHalfmoveClock = 0
+        self.initialPly = 0
+        self.nullMoveLog = []  # len(moveLog) at each null move still on the board, see makeNullMove
+
+    '''
+    Set up the position described by a FEN string, e.g. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1".
+    The move log is cleared. The halfmove and fullmove counters are optional and only used by getFEN.
+    '''
+    def loadFEN(self, fen):
+        fields = fen.split()
+        self.board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for character in rank:
+                if character.isdigit():
+                    row.extend(['--'] * int(character))
+                else:
+                    row.append(('w' if character.isupper() else 'b') + character.lower())
+            self.board.append(row)
+        for row in range(8):
+            for column in range(8):
+                if self.board[row][column] == 'wk':
+                    self.whiteKingLocation = (row, column)
+                elif self.board[row][column] == 'bk':
+                    self.blackKingLocation = (row, column)
+        self.whiteToMove = fields[1] == 'w'
+        castling = fields[2]
+        self.currentCastlingRight = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+        self.castleRightsLog = [CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)]
+        if fields[3] != '-':
+            self.enPassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToColumns[fields[3][0]])
+        else:
+            self.enPassantPossible = ()
+        self.enPassantPossibleLog = [self.enPassantPossible]
+        self.moveLog = []
+        self.nullMoveLog = []
+        self.inCheck = self.checkMate = self.staleMate = False
+        self.pins = []
+        self.checks = []
+        self.zobristKey = self.computeZobristKey()
+        self.zobristKeyLog = [self.zobristKey]
+        self.middlegameScore, self.endgameScore, self.phase = self.computeEvaluationState()
+        self.evaluationLog = [(self.middlegameScore, self.endgameScore, self.phase)]
+        self.initialHalfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.initialPly = 2 * (int(fields[5]) - 1 if len(fields) > 5 else 0) + (0 if self.whiteToMove else 1)
+
+    '''
+    The FEN string of the current position, the inverse of loadFEN
+    '''
+    def getFEN(self):
+        rows = []
+        for row in self.board:
+            fenRow = ''
+            emptySquares = 0
+            for square in row:
+                if square == '--':
+                    emptySquares += 1
+                    continue
+                if emptySquares:
+                    fenRow += str(emptySquares)
+                    emptySquares = 0
+                fenRow += square[1].upper() if square[0] == 'w' else square[1]
+            rows.append(fenRow + (str(emptySquares) if emptySquares else ''))
+        castleRights = self.currentCastlingRight
+        castling = ('K' if castleRights.whiteKingSide else '') + ('Q' if castleRights.whiteQueenSide else '') + \
+                   ('k' if castleRights.blackKingSide else '') + ('q' if castleRights.blackQueenSide else '')
+        enPassant = '-'
+        if self.enPassantPossible != ():
+            enPassant = Move.columnsToFiles[self.enPassantPossible[1]] + Move.rowsToRanks[self.enPassantPossible[0]]
+        # the halfmove clock counts the moves since the last capture or pawn move
+        halfmoveClock = 0
+        for move in reversed(self.moveLog):
+            if move.pieceCaptured != '--' or move.pieceMoved[1] == 'p':
+                break
+            halfmoveClock += 1
+        else:
+            halfmoveClock += self.initialHalfmoveClock
+        fullmoveNumber = (self.initialPly + len(self.moveLog)) // 2 + 1
+        return '/'.join(rows) + (' w ' if self.whiteToMove else ' b ') + (castling or '-') + ' ' + enPassant + ' ' + \
+            str(halfmoveClock) + ' ' + str(fullmoveNumber)
+
+    '''
+    Hash the whole position from scratch
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece != '--':
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + column]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRight.index()]
+        if self.enPassantPossible != ():
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantPossible[1]]
+        return key
+
+    '''
+    Compute the middlegame score, endgame score and phase of the whole board from scratch
+    '''
+    def computeEvaluationState(self):
+        middlegameScore = endgameScore = phase = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece != '--':
+                    middlegameScore += MIDDLEGAME_SCORES[piece][row * 8 + column]
+                    endgameScore += ENDGAME_SCORES[piece][row * 8 + column]
+                    phase += phaseWeight[piece[1]]
+        return middlegameScore, endgameScore, phase
+
+    '''
+    Static evaluation in centipawns from white's point of view, blending the middlegame and endgame scores by the phase
+    '''
+    def getEvaluation(self):
+        phase = min(self.phase, TOTAL_PHASE)  # early promotions can push the phase past the initial position
+        return (self.middlegameScore * phase + self.endgameScore * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+    '''
+    Number of pieces on the board, kings included
+    '''
+    def getPieceCount(self):
+        return sum(1 for row in self.board for piece in row if piece != '--')
 
     '''
     Takes a Move as a parameter and executes it
     '''
     def makeMove(self, move):
+        previousEnPassant = self.enPassantPossible
+        previousCastleRights = self.currentCastlingRight.index()
         self.board[move.startRow][move.startColumn] = "--"
         self.board[move.endRow][move.endColumn] = move.pieceMoved
         self.moveLog.append(move)  # log the move
@@ -78,11 +223,72 @@ class GameState:
         self.enPassantPossibleLog.append(self.enPassantPossible)
 
         # update castling rights - whenever a rook or a king moves
-        self.updateCastleRights(move)
+        if previousCastleRights:  # nothing to lose once all four are gone
+            self.updateCastleRights(move)
         self.castleRightsLog.append(
             CastleRights(self.currentCastlingRight.whiteKingSide, self.currentCastlingRight.blackKingSide,
                          self.currentCastlingRight.whiteQueenSide, self.currentCastlingRight.blackQueenSide))
 
+        self.updateZobristKey(move, previousEnPassant, previousCastleRights)
+        self.zobristKeyLog.append(self.zobristKey)
+        if DEBUG_ZOBRIST:
+            assert self.zobristKey == self.computeZobristKey(), "incremental Zobrist key out of sync after " + move.getChessNotation()
+        self.updateEvaluationState(move)
+        self.evaluationLog.append((self.middlegameScore, self.endgameScore, self.phase))
+        if DEBUG_EVALUATION:
+            assert (self.middlegameScore, self.endgameScore, self.phase) == self.computeEvaluationState(), \
+                "incremental evaluation out of sync after " + move.getChessNotation()
+
+    '''
+    XOR the changes of a move that was just made into the Zobrist key
+    '''
+    def updateZobristKey(self, move, previousEnPassant, previousCastleRights):
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow * 8 + move.startColumn]
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endColumn]][move.endRow * 8 + move.endColumn]  # differs from pieceMoved on promotion
+        if move.pieceCaptured != '--':
+            captureRow = move.startRow if move.isEnPassantMove else move.endRow
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][captureRow * 8 + move.endColumn]
+        if move.isCastleMove:
+            rookPieces = ZOBRIST_PIECES[move.pieceMoved[0] + 'r']
+            if move.endColumn - move.startColumn == 2:  # king side
+                key ^= rookPieces[move.endRow * 8 + 7] ^ rookPieces[move.endRow * 8 + 5]
+            else:  # queen side
+                key ^= rookPieces[move.endRow * 8] ^ rookPieces[move.endRow * 8 + 3]
+        if previousEnPassant != ():
+            key ^= ZOBRIST_EN_PASSANT[previousEnPassant[1]]
+        if self.enPassantPossible != ():
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantPossible[1]]
+        key ^= ZOBRIST_CASTLING[previousCastleRights] ^ ZOBRIST_CASTLING[self.currentCastlingRight.index()]
+        self.zobristKey = key
+
+    '''
+    Add the score changes of a move that was just made to the evaluation state
+    '''
+    def updateEvaluationState(self, move):
+        start = move.startRow * 8 + move.startColumn
+        end = move.endRow * 8 + move.endColumn
+        pieceLanded = self.board[move.endRow][move.endColumn]  # differs from pieceMoved on promotion
+        middlegameScore = self.middlegameScore + MIDDLEGAME_SCORES[pieceLanded][end] - MIDDLEGAME_SCORES[move.pieceMoved][start]
+        endgameScore = self.endgameScore + ENDGAME_SCORES[pieceLanded][end] - ENDGAME_SCORES[move.pieceMoved][start]
+        if pieceLanded != move.pieceMoved:
+            self.phase += phaseWeight[pieceLanded[1]] - phaseWeight[move.pieceMoved[1]]
+        if move.pieceCaptured != '--':
+            captured = (move.startRow if move.isEnPassantMove else move.endRow) * 8 + move.endColumn
+            middlegameScore -= MIDDLEGAME_SCORES[move.pieceCaptured][captured]
+            endgameScore -= ENDGAME_SCORES[move.pieceCaptured][captured]
+            self.phase -= phaseWeight[move.pieceCaptured[1]]
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + 'r'
+            if move.endColumn - move.startColumn == 2:  # king side
+                rookStart, rookEnd = move.endRow * 8 + 7, move.endRow * 8 + 5
+            else:  # queen side
+                rookStart, rookEnd = move.endRow * 8, move.endRow * 8 + 3
+            middlegameScore += MIDDLEGAME_SCORES[rook][rookEnd] - MIDDLEGAME_SCORES[rook][rookStart]
+            endgameScore += ENDGAME_SCORES[rook][rookEnd] - ENDGAME_SCORES[rook][rookStart]
+        self.middlegameScore = middlegameScore
+        self.endgameScore = endgameScore
+
     '''
     Update the castling rights for a given move
     '''
@@ -119,6 +325,37 @@ class GameState:
                 elif move.startColumn == 7:  # right rook
                     self.currentCastlingRight.blackKingSide = False
 
+    '''
+    Pass the turn without moving, for null-move pruning in the search. Never made while in check.
+    A null move is not added to the move log: it has to be taken back with undoNullMove, after the moves made on top of it.
+    The other logs get an entry like for any move, so undoMove restores the position after the null move correctly.
+    '''
+    def makeNullMove(self):
+        self.nullMoveLog.append(len(self.moveLog))
+        if self.enPassantPossible != ():
+            self.zobristKey ^= ZOBRIST_EN_PASSANT[self.enPassantPossible[1]]
+            self.enPassantPossible = ()
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+        self.whiteToMove = not self.whiteToMove
+        self.enPassantPossibleLog.append(self.enPassantPossible)
+        self.castleRightsLog.append(
+            CastleRights(self.currentCastlingRight.whiteKingSide, self.currentCastlingRight.blackKingSide,
+                         self.currentCastlingRight.whiteQueenSide, self.currentCastlingRight.blackQueenSide))
+        self.zobristKeyLog.append(self.zobristKey)
+        self.evaluationLog.append((self.middlegameScore, self.endgameScore, self.phase))
+
+    def undoNullMove(self):
+        self.nullMoveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        self.enPassantPossibleLog.pop()
+        self.enPassantPossible = self.enPassantPossibleLog[-1]
+        self.castleRightsLog.pop()
+        self.zobristKeyLog.pop()
+        self.zobristKey = self.zobristKeyLog[-1]
+        self.evaluationLog.pop()
+        self.checkMate = False
+        self.staleMate = False
+
     '''
     Undo the last move made.
     '''
@@ -144,7 +381,9 @@ class GameState:
 
             # undo castling rights
             self.castleRightsLog.pop()  # remove the new castling rights from the move we are undoing
-            self.currentCastlingRight = self.castleRightsLog[-1]  # set the castle rights to the last one in the list
+            lastRights = self.castleRightsLog[-1]  # set the castle rights to a copy of the last one in the list
+            self.currentCastlingRight = CastleRights(lastRights.whiteKingSide, lastRights.blackKingSide,
+                                                     lastRights.whiteQueenSide, lastRights.blackQueenSide)
             # undo castle move
             if move.isCastleMove:
                 if move.endColumn - move.startColumn == 2:  # king side
@@ -154,14 +393,29 @@ class GameState:
                     self.board[move.endRow][move.endColumn-2] = self.board[move.endRow][move.endColumn+1]
                     self.board[move.endRow][move.endColumn+1] = '--'
 
+            # restore the Zobrist key of the previous position
+            self.zobristKeyLog.pop()
+            self.zobristKey = self.zobristKeyLog[-1]
+            if DEBUG_ZOBRIST:
+                assert self.zobristKey == self.computeZobristKey(), "Zobrist key out of sync after undoing " + move.getChessNotation()
+            # restore the evaluation state of the previous position
+            self.evaluationLog.pop()
+            self.middlegameScore, self.endgameScore, self.phase = self.evaluationLog[-1]
+            if DEBUG_EVALUATION:
+                assert (self.middlegameScore, self.endgameScore, self.phase) == self.computeEvaluationState(), \
+                    "evaluation out of sync after undoing " + move.getChessNotation()
+
             # undo checkmate and stalemate
             self.checkMate = False
             self.staleMate = False
 
     '''
     All valid moves considering checks. e.g. can't move a piece if it's pinned to a king
+    With capturesOnly only the valid captures are generated (for quiescence search). Checkmate and stalemate can't be
+    decided from captures alone, so in that mode they are left False.
     '''
-    def getValidMoves(self):
+    def getValidMoves(self, capturesOnly=False):
+        self.capturesOnly = capturesOnly
         tempCastleRights = CastleRights(self.currentCastlingRight.whiteKingSide, self.currentCastlingRight.blackKingSide,
                                         self.currentCastlingRight.whiteQueenSide, self.currentCastlingRight.blackQueenSide)
         moves = []
@@ -195,17 +449,21 @@ class GameState:
                 for index in range(len(moves) - 1, -1, -1):  # iterate backwards through the list while removing from it
                     if moves[index].pieceMoved[1] != 'k':  # given move doesn't move king, so it must block or capture
                         if not (moves[index].endRow, moves[index].endColumn) in validSquares:  # given move doesn't block check or capture the piece
-                            moves.remove(moves[index])
+                            # an en passant capture lands behind the checking pawn it removes
+                            if not (moves[index].isEnPassantMove and (moves[index].startRow, moves[index].endColumn) == (checkRow, checkColumn)):
+                                moves.remove(moves[index])
             else:  # king is under double check, so it has to move
                 self.getKingMoves(kingRow, kingColumn, moves)
         else:  # not in check, so all moves can be played
             moves = self.getAllPossibleMoves()
-            if self.whiteToMove:
-                self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
-            else:
-                self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
+            if not capturesOnly:  # castling never captures
+                if self.whiteToMove:
+                    self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+                else:
+                    self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
 
-        if len(moves) == 0:  # either checkmate or stalemate
+        self.capturesOnly = False
+        if len(moves) == 0 and not capturesOnly:  # either checkmate or stalemate
             if self.isInCheck():
                 self.checkMate = True
             else:
@@ -295,15 +553,37 @@ class GameState:
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
     '''
-    Check whether the enemy attacks the square at given row and column
+    Check whether the enemy attacks the square at given row and column. Traces outward from the square along rays,
+    knight jumps and pawn diagonals, so no moves have to be generated. Also covers empty squares (e.g. for castling)
     '''
     def squareUnderAttack(self, row, column):
-        self.whiteToMove = not self.whiteToMove  # switch the turn to check opponents moves
-        opponentsMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # switch the turn back
-        for move in opponentsMoves:
-            if move.endRow == row and move.endColumn == column:  # square is under attack
+        board = self.board
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        # orthogonal rays can hold a rook or queen, diagonal rays a bishop or queen, and the first square also a king
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for directionsIndex in range(8):
+            rowStep, columnStep = directions[directionsIndex]
+            sliders = 'rq' if directionsIndex < 4 else 'bq'
+            endRow, endColumn = row + rowStep, column + columnStep
+            distance = 1
+            while 0 <= endRow < 8 and 0 <= endColumn < 8:
+                endPiece = board[endRow][endColumn]
+                if endPiece != '--':
+                    if endPiece[0] == enemyColor and (endPiece[1] in sliders or (distance == 1 and endPiece[1] == 'k')):
+                        return True
+                    break
+                endRow, endColumn = endRow + rowStep, endColumn + columnStep
+                distance += 1
+        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        for rowStep, columnStep in knightMoves:
+            endRow, endColumn = row + rowStep, column + columnStep
+            if 0 <= endRow < 8 and 0 <= endColumn < 8 and board[endRow][endColumn] == enemyColor + 'n':
                 return True
+        pawnRow = row + 1 if enemyColor == 'w' else row - 1  # white pawns attack towards row 0, black pawns towards row 7
+        if 0 <= pawnRow < 8:
+            for endColumn in (column - 1, column + 1):
+                if 0 <= endColumn < 8 and board[pawnRow][endColumn] == enemyColor + 'p':
+                    return True
         return False
 
     '''
@@ -336,15 +616,13 @@ class GameState:
             moveAmount = -1
             startRow = 6
             enemyColor = "b"
-            kingRow, kingColumn = self.whiteKingLocation
         else:
             moveAmount = 1
             startRow = 1
             enemyColor = "w"
-            kingRow, kingColumn = self.blackKingLocation
 
-        if self.board[row+moveAmount][column] == "--":  # 1 square pawn advance
-            if not piecePinned or pinDirection == (moveAmount, 0):
+        if self.board[row+moveAmount][column] == "--" and not self.capturesOnly:  # 1 square pawn advance
+            if not piecePinned or pinDirection in ((moveAmount, 0), (-moveAmount, 0)):  # along the pin, either way
                 moves.append(Move((row, column), (row + moveAmount, column), self.board))
                 if row == startRow and self.board[row + 2 * moveAmount][column] == "--":  # 2 square pawn advance
                     moves.append(Move((row, column), (row + 2 * moveAmount, column), self.board))
@@ -353,50 +631,32 @@ class GameState:
                 if self.board[row + moveAmount][column - 1][0] == enemyColor:
                     moves.append(Move((row, column), (row + moveAmount, column - 1), self.board))
                 if (row + moveAmount, column - 1) == self.enPassantPossible:
-                    attackingPiece = blockingPiece = False
-                    if kingRow == row:
-                        if kingColumn < column:  # king is on the left of the pawn
-                            insideRange = range(kingColumn + 1, column - 1)
-                            outsideRange = range(column + 1, 8)
-                        else:  # king is on the right of the pawn
-                            insideRange = range(kingColumn - 1, column, -1)
-                            outsideRange = range(column - 2, -1, -1)
-                        for index in insideRange:
-                            if self.board[row][index] != '--':
-                                blockingPiece = True
-                        for index in outsideRange:
-                            square = self.board[row][index]
-                            if square[0] == enemyColor and (square[1] == 'r' or square[1] == 'q'):  # attacking piece
-                                attackingPiece = True
-                            elif square != '--':
-                                blockingPiece = True
-                    if not attackingPiece or blockingPiece:
+                    if not self.enPassantExposesKing(row, column, column - 1, moveAmount):
                         moves.append(Move((row, column), (row + moveAmount, column - 1), self.board, isEnPassantMove=True))
         if column + 1 <= 7:  # capture to the right
             if not piecePinned or pinDirection == (moveAmount, +1):
                 if self.board[row + moveAmount][column + 1][0] == enemyColor:
                     moves.append(Move((row, column), (row + moveAmount, column + 1), self.board))
                 if (row + moveAmount, column + 1) == self.enPassantPossible:
-                    attackingPiece = blockingPiece = False
-                    if kingRow == row:
-                        if kingColumn < column:  # king is on the left of the pawn
-                            insideRange = range(kingColumn + 1, column)
-                            outsideRange = range(column + 2, 8)
-                        else:  # king is on the right of the pawn
-                            insideRange = range(kingColumn - 1, column + 1, -1)
-                            outsideRange = range(column - 1, -1, -1)
-                        for index in insideRange:
-                            if self.board[row][index] != '--':
-                                blockingPiece = True
-                        for index in outsideRange:
-                            square = self.board[row][index]
-                            if square[0] == enemyColor and (square[1] == 'r' or square[1] == 'q'):  # attacking piece
-                                attackingPiece = True
-                            elif square != '--':
-                                blockingPiece = True
-                    if not attackingPiece or blockingPiece:
+                    if not self.enPassantExposesKing(row, column, column + 1, moveAmount):
                         moves.append(Move((row, column), (row + moveAmount, column + 1), self.board, isEnPassantMove=True))
 
+    '''
+    Whether capturing en passant would leave the own king in check. Two pawns leave the row at once, which can uncover
+    a rook or queen along the row, or a bishop or queen along the diagonal of the captured pawn, so play it out and look
+    '''
+    def enPassantExposesKing(self, row, column, endColumn, moveAmount):
+        pawn = self.board[row][column]
+        capturedPawn = self.board[row][endColumn]
+        self.board[row][column] = '--'
+        self.board[row][endColumn] = '--'
+        self.board[row + moveAmount][endColumn] = pawn
+        inCheck = self.checkForPinsAndChecks()[0]
+        self.board[row][column] = pawn
+        self.board[row][endColumn] = capturedPawn
+        self.board[row + moveAmount][endColumn] = '--'
+        return inCheck
+
     '''
     Get all the rook moves for the pawn located at row, column and add these moves to the list
     '''
@@ -421,7 +681,8 @@ class GameState:
                     if not piecePinned or pinDirection == direction or pinDirection == (-direction[0], -direction[1]):
                         endPiece = self.board[endRow][endColumn]
                         if endPiece == "--":  # empty space is valid
-                            moves.append(Move((row, column), (endRow, endColumn), self.board))
+                            if not self.capturesOnly:
+                                moves.append(Move((row, column), (endRow, endColumn), self.board))
                         elif endPiece[0] == enemyColor:  # capture enemy piece
                             moves.append(Move((row, column), (endRow, endColumn), self.board))
                             break
@@ -440,7 +701,8 @@ class GameState:
             if self.pins[index][0] == row and self.pins[index][1] == column:
                 piecePinned = True
                 pinDirection = (self.pins[index][2], self.pins[index][3])
-                self.pins.remove(self.pins[index])
+                if self.board[row][column][1] != 'q':  # queens keep the pin for getRookMoves
+                    self.pins.remove(self.pins[index])
                 break
 
         directions = ((1, 1), (1, -1), (-1, 1), (-1, -1))
@@ -453,7 +715,8 @@ class GameState:
                     if not piecePinned or pinDirection == direction or pinDirection == (-direction[0], -direction[1]):
                         endPiece = self.board[endRow][endColumn]
                         if endPiece == "--":  # empty space is valid
-                            moves.append(Move((row, column), (endRow, endColumn), self.board))
+                            if not self.capturesOnly:
+                                moves.append(Move((row, column), (endRow, endColumn), self.board))
                         elif endPiece[0] == enemyColor:  # capture enemy piece
                             moves.append(Move((row, column), (endRow, endColumn), self.board))
                             break
@@ -481,7 +744,7 @@ class GameState:
             if 0 <= endRow < 8 and 0 <= endColumn < 8:  # check for possible moves only in boundaries of the board
                 if not piecePinned:
                     endPiece = self.board[endRow][endColumn]
-                    if endPiece[0] != allyColor:  # so it's either enemy piece or empty square
+                    if endPiece[0] != allyColor and (endPiece != '--' or not self.capturesOnly):  # so it's either enemy piece or empty square
                         moves.append(Move((row, column), (endRow, endColumn), self.board))
 
     '''
@@ -503,7 +766,7 @@ class GameState:
             endColumn = column + columnMoves[index]
             if 0 <= endRow < 8 and 0 <= endColumn < 8:
                 endPiece = self.board[endRow][endColumn]
-                if endPiece[0] != allyColor:  # not a white piece, empty or enemy piece
+                if endPiece[0] != allyColor and (endPiece != '--' or not self.capturesOnly):  # not a white piece, empty or enemy piece
                     # place king on end square and check for checks
                     if allyColor == 'w':
                         self.whiteKingLocation = (endRow, endColumn)
@@ -540,12 +803,21 @@ class GameState:
                 moves.append(Move((row, column), (row, column-2), self.board, isCastleMove=True))
 
 class CastleRights:
+    # a copy is logged at every move, see Move
+    __slots__ = ('whiteKingSide', 'blackKingSide', 'whiteQueenSide', 'blackQueenSide')
+
     def __init__(self, whiteKingSide, blackKingSide, whiteQueenSide, blackQueenSide):
         self.whiteKingSide = whiteKingSide
         self.blackKingSide = blackKingSide
         self.whiteQueenSide = whiteQueenSide
         self.blackQueenSide = blackQueenSide
 
+    '''
+    The four rights packed into a number from 0 to 15, used to index the Zobrist castling keys
+    '''
+    def index(self):
+        return self.whiteKingSide | self.whiteQueenSide << 1 | self.blackKingSide << 2 | self.blackQueenSide << 3
+
 
 class Move:
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
@@ -553,23 +825,30 @@ class Move:
     filesToColumns = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     columnsToFiles = {value: key for key, value in filesToColumns.items()}
 
+    # one Move is built for every valid move at every node, slots keep them small and quick to create
+    __slots__ = ('startRow', 'startColumn', 'endRow', 'endColumn', 'pieceMoved', 'pieceCaptured',
+                 'isPawnPromotion', 'isEnPassantMove', 'isCastleMove', 'moveID')
+
     def __init__(self, startSquare, endSquare, board, isEnPassantMove=False, isCastleMove=False):
-        self.startRow = startSquare[0]
-        self.startColumn = startSquare[1]
-        self.endRow = endSquare[0]
-        self.endColumn = endSquare[1]
-        self.pieceMoved = board[self.startRow][self.startColumn]
-        self.pieceCaptured = board[self.endRow][self.endColumn]
+        startRow, startColumn = startSquare
+        endRow, endColumn = endSquare
+        self.startRow = startRow
+        self.startColumn = startColumn
+        self.endRow = endRow
+        self.endColumn = endColumn
+        pieceMoved = self.pieceMoved = board[startRow][startColumn]
         # pawn promotion
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.isPawnPromotion = (pieceMoved == 'wp' and endRow == 0) or (pieceMoved == 'bp' and endRow == 7)
         # en passant move
         self.isEnPassantMove = isEnPassantMove
-        if self.isEnPassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+        if isEnPassantMove:
+            self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
+        else:
+            self.pieceCaptured = board[endRow][endColumn]
         # castle move
         self.isCastleMove = isCastleMove
         # Move ID
-        self.moveID = self.startRow * 1000 + self.startColumn * 100 + self.endRow * 10 + self.endColumn
+        self.moveID = startRow * 1000 + startColumn * 100 + endRow * 10 + endColumn
 
     '''
     Override equals method
@@ -579,6 +858,12 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    '''
+    Moves that are equal hash the same, so moves can be kept in sets and used as dictionary keys
+    '''
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
         return self.getRankFile(self.startRow, self.startColumn) + self.getRankFile(self.endRow, self.endColumn)
 
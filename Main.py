@@ -1,8 +1,11 @@
 """
 This file is responsible for handling user input and displaying the current GameState object.
 """
+import copy
+import threading
 import pygame as py
 import Engine
+import BitboardEngine
 import ChessAI
 
 WIDTH = HEIGHT = 512  # change to 1024 to make window bigger
@@ -11,6 +14,12 @@ SQUARE_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15  # for animations
 IMAGES = {}
 colors = [py.Color("white"), py.Color("grey")]  # Square colors
+BOARD_BACKGROUND = None  # the empty board, rendered once by createBoardSurfaces
+HIGHLIGHTS = {}  # translucent square overlays by color name
+FONTS = {}  # by size, created once by loadFonts
+TEXT_OVERLAYS = {}  # text -> rendered textOverlay surface, so an idle frame does not render it again
+displayedSquares = {}  # (row, column) -> (piece, highlight) as currently on screen, for drawing only what changed
+displayedOverlays = []  # (key, rect) of the texts currently drawn over the board
 
 '''
 Initialize a global dictionary of images. This will be called only once in the main.
@@ -21,6 +30,30 @@ def loadImages():
         IMAGES[piece] = py.transform.scale(py.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
 
 
+'''
+Create the fonts of the overlays once, after py.init()
+'''
+def loadFonts():
+    for size in (14, 32):
+        FONTS[size] = py.font.Font(py.font.get_default_font(), size)
+
+
+'''
+Render the empty board and the highlight squares once, drawing a frame then only copies parts of them
+'''
+def createBoardSurfaces():
+    global BOARD_BACKGROUND
+    BOARD_BACKGROUND = py.Surface((WIDTH, HEIGHT)).convert()
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            py.draw.rect(BOARD_BACKGROUND, colors[(row + column) % 2], squareRect(row, column))
+    for color in ('blue', 'yellow'):
+        square = py.Surface((SQUARE_SIZE, SQUARE_SIZE))
+        square.set_alpha(100)  # transparency value (0 - transparent, 255 opaque)
+        square.fill(py.Color(color))
+        HIGHLIGHTS[color] = square
+
+
 '''
 Handle user input and update images here
 '''
@@ -29,22 +62,31 @@ def main():
     screen = py.display.set_mode((WIDTH, HEIGHT))
     clock = py.time.Clock()
     screen.fill((py.Color("white")))
-    gameState = Engine.GameState()
+    createBoardSurfaces()
+    displayedSquares.clear()
+    displayedOverlays.clear()
+    gameState = BitboardEngine.GameState()
     validMoves = gameState.getValidMoves()
     moveMade = False
     animate = False
 
     loadImages()  # load images only once
+    loadFonts()
     running = True
     squareSelected = ()  # keep track of the last user click in a tuple (row, column)
     playerClicks = []  # keep track of player clicks in tuples.
     gameOver = False
     playerOne = True  # if a human is white, then this will be true. If AI, then false
     playerTwo = True  # same as above but for black
+    aiThinking = False  # an AI search is running in the background
+    aiThread = None
+    aiResult = None
     while running:
         humanTurn = (gameState.whiteToMove and playerOne) or (not gameState.whiteToMove and playerTwo)
         for event in py.event.get():
             if event.type == py.QUIT:
+                stopAISearch(aiThread)
+                aiThinking = False
                 running = False
             # mouse handlers
             elif event.type == py.MOUSEBUTTONDOWN:
@@ -74,27 +116,44 @@ def main():
             # key handlers
             elif event.type == py.KEYDOWN:
                 if event.key == py.K_u:  # undo when 'u' is pressed
+                    stopAISearch(aiThread)
+                    aiThinking = False
                     gameState.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
                 if event.key == py.K_r:  # reset the board when 'r' is pressed
-                    gameState = Engine.GameState()
+                    stopAISearch(aiThread)
+                    aiThinking = False
+                    gameState = BitboardEngine.GameState()
                     validMoves = gameState.getValidMoves()
                     squareSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
                     gameOver = False
+        if not running:  # the window was closed, the stopped search's move is not played
+            break
 
-        # AI move finder
-        if not gameOver and not humanTurn:
-            aiMove = ChessAI.findBestMove(gameState, validMoves)
-            if aiMove is None:
-                aiMove = ChessAI.findRandomMove(validMoves)
-            gameState.makeMove(aiMove)
-            moveMade = True
-            animate = True
+        # AI move finder, runs in the background so the window keeps responding while it thinks.
+        # It waits for the frame after an undo, when validMoves and humanTurn are up to date again
+        if not gameOver and not humanTurn and not moveMade:
+            if not aiThinking:
+                aiThread, aiResult = startAISearch(gameState, validMoves)
+                aiThinking = True
+            elif not aiThread.is_alive():
+                aiThinking = False
+                aiMove = aiResult[0] if aiResult and aiResult[0] is not None else ChessAI.findRandomMove(validMoves)
+                if ChessAI.moveSource != 'search':
+                    print(aiMove.getChessNotation() + " (" + ChessAI.moveSource + ")")
+                elif ChessAI.completedDepth == 0:  # the search was stopped
+                    print(aiMove.getChessNotation())
+                else:
+                    print(aiMove.getChessNotation() + " (depth " + str(ChessAI.completedDepth) + ", pv " +
+                          variationText(ChessAI.principalVariation) + ")")
+                gameState.makeMove(validMoves[validMoves.index(aiMove)])  # the search returns a move of its own copy
+                moveMade = True
+                animate = True
 
         if moveMade:
             if animate:
@@ -103,103 +162,176 @@ def main():
             moveMade = False
             animate = False
 
-        drawGameState(screen, gameState, validMoves, squareSelected)
+        overlays = []
+        if aiThinking:
+            overlays.append(searchProgressOverlay())
         if gameState.checkMate:
             gameOver = True
-            drawText(screen, 'Checkmate')
+            overlays.append(textOverlay('Checkmate'))
         elif gameState.staleMate:
             gameOver = True
-            drawText(screen, 'Stalemate')
+            overlays.append(textOverlay('Stalemate'))
+        dirtyRects = drawGameState(screen, gameState, validMoves, squareSelected, overlays)
+        if dirtyRects:  # nothing is sent to the display while the board stays the same
+            py.display.update(dirtyRects)
 
         clock.tick(MAX_FPS)
-        py.display.flip()
+    ChessAI.shutdownSearchPool()  # the worker processes of a parallel search would outlive the window otherwise
 
 
 '''
-Highlight the selected square and move the selected piece
+Start ChessAI.findBestMove in a background thread. It searches a copy of the game state, so the board can be drawn
+and changed meanwhile. Returns the thread and a list the move is appended to when the search is done
 '''
-def highlightSquares(screen, gameState, validMoves, squareSelected):
+def startAISearch(gameState, validMoves):
+    searchState, searchMoves = copy.deepcopy((gameState, validMoves))
+    result = []
+    thread = threading.Thread(target=lambda: result.append(ChessAI.findBestMove(searchState, searchMoves)), daemon=True)
+    thread.start()
+    return thread, result
+
+
+'''
+Stop a running AI search and wait for its thread to finish, so a new search never runs alongside an old one
+'''
+def stopAISearch(thread):
+    if thread is not None and thread.is_alive():
+        ChessAI.stopRequested = True
+        thread.join()
+        ChessAI.stopRequested = False
+
+
+'''
+Overlay with the depth, the nodes and the principal variation so far of the running AI search in the top left corner
+'''
+def searchProgressOverlay():
+    font = FONTS[14]
+    text = "Thinking... depth " + str(ChessAI.rootDepth) + ", " + str(ChessAI.nodeCount) + " nodes"
+    if ChessAI.principalVariation:
+        text += ", pv " + variationText(ChessAI.principalVariation)
+    textObject = font.render(text, True, py.Color("Black"), py.Color("white"))
+    return text, textObject, textObject.get_rect(topleft=(4, 4))
+
+
+def variationText(moves):
+    return " ".join(move.getChessNotation() for move in moves)
+
+
+'''
+Overlay with a large shadowed text in the middle of the board
+'''
+def textOverlay(text):
+    textObject = TEXT_OVERLAYS.get(text)
+    if textObject is None:
+        font = FONTS[32]
+        shadow = font.render(text, False, py.Color('Gray'))
+        textObject = py.Surface((shadow.get_width() + 2, shadow.get_height() + 2), py.SRCALPHA)
+        textObject.blit(shadow, (0, 0))
+        textObject.blit(font.render(text, False, py.Color("Black")), (2, 2))
+        TEXT_OVERLAYS[text] = textObject
+    return text, textObject, textObject.get_rect(center=(WIDTH // 2, HEIGHT // 2))
+
+
+def squareRect(row, column):
+    return py.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+
+'''
+The (row, column) of every board square that rect overlaps
+'''
+def squaresUnder(rect):
+    rect = rect.clip(py.Rect(0, 0, WIDTH, HEIGHT))
+    return [(row, column) for row in range(rect.top // SQUARE_SIZE, (rect.bottom - 1) // SQUARE_SIZE + 1)
+            for column in range(rect.left // SQUARE_SIZE, (rect.right - 1) // SQUARE_SIZE + 1)]
+
+
+'''
+Highlight colors by square: blue for the selected square, yellow for where the selected piece can move
+'''
+def getHighlights(gameState, validMoves, squareSelected):
+    highlights = {}
     if squareSelected != ():
         row, column = squareSelected
         if gameState.board[row][column][0] == ('w' if gameState.whiteToMove else 'b'):  # square selected is a piece that can be moved
-            # highlight selected square
-            square = py.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            square.set_alpha(100)  # transparency value (0 - transparent, 255 opaque)
-            square.fill(py.Color('blue'))
-            screen.blit(square, (column*SQUARE_SIZE, row*SQUARE_SIZE))
-            # highlight moves from that square
-            square.fill(py.Color('yellow'))
+            highlights[(row, column)] = 'blue'
             for move in validMoves:
                 if move.startRow == row and move.startColumn == column:
-                    screen.blit(square, (move.endColumn*SQUARE_SIZE, move.endRow*SQUARE_SIZE))
+                    highlights[(move.endRow, move.endColumn)] = 'yellow'
+    return highlights
 
 
 '''
-Responsible for all graphics within a current game state.
+Draw one square from the board background, with its highlight and piece on top
 '''
-def drawGameState(screen, gameState, validMoves, squareSelected):
-    drawBoard(screen)
-    highlightSquares(screen, gameState, validMoves, squareSelected)
-    drawPieces(screen, gameState.board)
+def drawSquare(screen, row, column, piece, highlight):
+    rect = squareRect(row, column)
+    screen.blit(BOARD_BACKGROUND, rect, rect)
+    if highlight is not None:
+        screen.blit(HIGHLIGHTS[highlight], rect)
+    if piece != "--":
+        screen.blit(IMAGES[piece], rect)
+    return rect
 
 
 '''
-Draw the board squares
+Responsible for all graphics within a current game state. Only the squares whose piece or highlight changed since
+the last call are redrawn, plus the squares under overlays (texts) that appeared, changed or went away.
+Returns the rectangles that changed, for py.display.update
 '''
-def drawBoard(screen):
+def drawGameState(screen, gameState, validMoves, squareSelected, overlays=()):
+    highlights = getHighlights(gameState, validMoves, squareSelected)
+    overlaysChanged = [key for key, rect in displayedOverlays] != [key for key, textObject, rect in overlays]
+    stale = set()
+    if overlaysChanged:
+        for rect in [rect for key, rect in displayedOverlays] + [rect for key, textObject, rect in overlays]:
+            stale.update(squaresUnder(rect))
+    dirtyRects = []
     for row in range(DIMENSION):
         for column in range(DIMENSION):
-            color = colors[(row + column) % 2]
-            py.draw.rect(screen, color, py.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+            contents = (gameState.board[row][column], highlights.get((row, column)))
+            if (row, column) in stale or displayedSquares.get((row, column)) != contents:
+                dirtyRects.append(drawSquare(screen, row, column, *contents))
+                displayedSquares[(row, column)] = contents
+    for key, textObject, rect in overlays:
+        if overlaysChanged or rect.collidelist(dirtyRects) != -1:
+            screen.blit(textObject, rect)
+            dirtyRects.append(rect)
+    displayedOverlays[:] = [(key, rect) for key, textObject, rect in overlays]
+    return dirtyRects
 
 
 '''
-Draw the pieces on the board
+Animate a move. Each frame redraws only the squares under the moving piece's previous and current position
 '''
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                screen.blit(IMAGES[piece], py.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-
-# '''
-# Animate a move
-# '''
 def animateMove(move, screen, board, clock):
     deltaRow = move.endRow - move.startRow
     deltaColumn = move.endColumn - move.startColumn
     framesPerSquare = 20
     frameCount = (abs(deltaRow) + abs(deltaColumn)) * framesPerSquare
+    # the board already shows the move, but the captured piece stays on its square until the moving piece arrives
+    capturedSquare = (move.endRow, move.endColumn)
+    if move.isEnPassantMove:
+        capturedSquare = (move.endRow + 1 if move.pieceCaptured[0] == 'b' else move.endRow - 1, move.endColumn)
+    previousRect = squareRect(move.startRow, move.startColumn)
     for frame in range(frameCount + 1):
         row, column = (move.startRow + deltaRow*frame/frameCount, move.startColumn + deltaColumn*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endColumn) % 2]
-        endSquare = py.Rect(move.endColumn*SQUARE_SIZE, move.endRow*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        py.draw.rect(screen, color, endSquare)
-        # draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            if move.isEnPassantMove:
-                enPassantRow = move.endRow + 1 if move.pieceCaptured[0] == 'b' else move.endRow - 1
-                endSquare = py.Rect(move.endColumn * SQUARE_SIZE, enPassantRow * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
+        pieceRect = py.Rect(column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        dirtyRect = previousRect.union(pieceRect)
+        for squareRow, squareColumn in squaresUnder(dirtyRect):
+            piece = board[squareRow][squareColumn]
+            if (squareRow, squareColumn) == (move.endRow, move.endColumn):
+                piece = '--'
+            if (squareRow, squareColumn) == capturedSquare:
+                piece = move.pieceCaptured
+            drawSquare(screen, squareRow, squareColumn, piece, None)
+            displayedSquares.pop((squareRow, squareColumn), None)  # so drawGameState repaints it after the animation
         # draw moving piece
         if move.pieceMoved != '--':
-            screen.blit(IMAGES[move.pieceMoved], py.Rect(column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        py.display.flip()
+            screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        py.display.update(dirtyRect)
+        previousRect = pieceRect
         clock.tick(360)
 
-def drawText(screen, text):
-    font = py.font.Font(py.font.get_default_font(), 32)
-    textObject = font.render(text, False, py.Color('Gray'))
-    textLocation = py.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
-    textObject = font.render(text, False, py.Color("Black"))
-    screen.blit(textObject, textLocation.move(2, 2))
-
 
 if __name__ == "__main__":
     main()
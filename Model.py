@@ -1,136 +1,529 @@
-# import chess
+import chess
 import chess.engine
+import chess.polyglot
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
 import numpy as np
-# import pandas as pd
-import tensorflow as tf
-# from tensorflow.keras.models import Model
-# from tensorflow.keras.layers import Dense, Flatten, Conv2D, Input, Dropout, Add, Concatenate
-# import random
-
-from tensorflow.python.keras.models import load_model
-
-Model = tf.keras.models
-Dense = tf.keras.layers.Dense
-Flatten = tf.keras.layers.Flatten
-Conv2D = tf.keras.layers.Conv2D
-Input = tf.keras.layers.Input
-Dropout = tf.keras.layers.Dropout
-Add = tf.keras.layers.Add
-Concatenate = tf.keras.layers.Concatenate
-Adam = tf.keras.optimizers.Adam
 
 # Define the input shape (8x8 chess board with 16 channels: 14 piece types + 2 for coordinates)
 input_shape = (8, 8, 16)
 
+WEIGHTS_PATH = 'chess_model.h5'
+EXPORT_PATH = 'chess_model.npz'  # inference-only weights written by export_weights, used instead of TensorFlow if present
+EVALUATION_CACHE_SIZE = 100000  # positions, an entry takes roughly 600 bytes
+STOCKFISH_PATH = os.environ.get('STOCKFISH_PATH', '/usr/local/Cellar/stockfish/15.1/bin/stockfish')
+
+# TensorFlow, the model and the batch evaluator are loaded on first use (importing TensorFlow alone takes seconds),
+# so importing this module stays cheap. Use load_tensorflow(), get_model() and get_batch_evaluator() instead.
+tf = None
+model = None
+evaluate_batch = None
+
+
+def load_tensorflow():
+    global tf
+    if tf is None:
+        import tensorflow
+        tf = tensorflow
+    return tf
+
+
 # Create the model
 def create_model():
-    inputs = Input(shape=input_shape)
-    x = Conv2D(64, kernel_size=3, activation='relu', padding='same')(inputs)
-    x = Dropout(0.5)(x)
-    x = Conv2D(16, kernel_size=3, padding='same')(x)  # Change 128 to 16
-    x = Add()([inputs, x])
+    tf = load_tensorflow()
+    layers = tf.keras.layers
+    inputs = layers.Input(shape=input_shape)
+    x = layers.Conv2D(64, kernel_size=3, activation='relu', padding='same')(inputs)
+    x = layers.Dropout(0.5)(x)
+    x = layers.Conv2D(16, kernel_size=3, padding='same')(x)  # Change 128 to 16
+    x = layers.Add()([inputs, x])
     x = tf.keras.activations.relu(x)
-    x = Dropout(0.5)(x)
-    x = Flatten()(x)
-    x = Dense(512, activation='relu')(x)
-    x = Dropout(0.5)(x)
-    outputs = Dense(1, activation='tanh')(x)
-    model = Model.Model(inputs=inputs, outputs=outputs)
+    x = layers.Dropout(0.5)(x)
+    x = layers.Flatten()(x)
+    x = layers.Dense(512, activation='relu')(x)
+    x = layers.Dropout(0.5)(x)
+    outputs = layers.Dense(1, activation='tanh')(x)
+    model = tf.keras.models.Model(inputs=inputs, outputs=outputs)
     model.compile(loss='mean_squared_error', optimizer='adam')
     return model
 
+
+# The process-wide model, created and loaded from weights_path by the first call and shared by every later one
+def get_model(weights_path=WEIGHTS_PATH):
+    global model
+    if model is None:
+        loaded = create_model()
+        loaded.load_weights(weights_path)
+        model = loaded
+    return model
+
+# Piece planes 0-11 in tensor order: black p, r, n, b, q, k then white P, R, N, B, Q, K
+PIECE_PLANES = [(piece_type, color) for color in (chess.BLACK, chess.WHITE)
+                for piece_type in (chess.PAWN, chess.ROOK, chess.KNIGHT, chess.BISHOP, chess.QUEEN, chess.KING)]
+
+# Coordinate planes 12/13. They were meant to hold row/7 and column/7, but were written into the uint8 tensor,
+# which truncates every value below 1.0 to 0: only the last row (plane 12) and the last column (plane 13) are 1.
+# chess_model.h5 was trained on exactly these planes, so they are kept as they are until the model is retrained.
+COORDINATE_PLANES = np.zeros((8, 8, 2), dtype=np.uint8)
+COORDINATE_PLANES[7, :, 0] = 1
+COORDINATE_PLANES[:, 7, 1] = 1
+
+
+# The 14 square sets of a position as 64-bit masks (bit i = python-chess square i = tensor cell [i // 8, i % 8]):
+# the 12 piece bitboards, then the targets of the legal moves for white to move and for black to move
+def board_masks(board):
+    masks = [board.pieces_mask(piece_type, color) for piece_type, color in PIECE_PLANES]
+    targets = 0
+    for move in board.generate_legal_moves():
+        targets |= 1 << move.to_square
+    masks += [targets, 0] if board.turn else [0, targets]
+    return masks
+
+
+# Unpack rows of board_masks into (N, 8, 8, 16) tensors, writing into out when it is given
+def masks_to_tensors(masks, out=None):
+    masks = np.asarray(masks, dtype='<u8').reshape(-1, 14)
+    if out is None:
+        out = np.empty((len(masks),) + input_shape, dtype=np.uint8)
+    bits = np.unpackbits(masks.view(np.uint8), axis=1, bitorder='little').reshape(len(masks), 14, 8, 8)
+    out[..., :12] = bits[:, :12].transpose(0, 2, 3, 1)
+    out[..., 12:14] = COORDINATE_PLANES
+    out[..., 14:] = bits[:, 12:].transpose(0, 2, 3, 1)
+    return out
+
+
 def board_to_tensor(board):
-    piece_dict = {'p': 0, 'P': 6, 'r': 1, 'R': 7, 'n': 2, 'N': 8, 'b': 3, 'B': 9, 'q': 4, 'Q': 10, 'k': 5, 'K': 11}
-    tensor = np.zeros((8, 8, 16), dtype=np.uint8)  # Change to 16 in third dimension
+    return masks_to_tensors([board_masks(board)])[0]
 
-    for i in range(64):
-        piece = board.piece_at(i)
-        if piece:
-            tensor[i // 8, i % 8, piece_dict[str(piece)]] = 1
 
-    legal_moves = list(board.legal_moves)
-    for move in legal_moves:
-        if board.turn:  # White to move
-            tensor[move.to_square // 8, move.to_square % 8, 14] = 1
-        else:  # Black to move
-            tensor[move.to_square // 8, move.to_square % 8, 15] = 1
-
-    # Add coordinates
-    for i in range(8):
-        for j in range(8):
-            tensor[i, j, 12] = i / 7.0  # Normalize coordinates to be in range [0, 1]
-            tensor[i, j, 13] = j / 7.0
-
-    return tensor
-
-
-# # Load dataset
-# data = pd.read_csv('chessData.csv')
-#
-# # Remove rows where Evaluation starts with '#'
-# data = data[~data['Evaluation'].str.startswith('#')]
-#
-# # Take the first n positions
-# data = data.head(500000)
-#
-# # Convert FEN strings to board tensors and centipawn scores to normalized scores
-# x_train = []
-# y_train = []
-#
-# for index, row in data.iterrows():
-#     print(index)
-#     fen = row['FEN']
-#     score = float(row['Evaluation'])
-#
-#     # Normalizing centipawn scores to range of -1 to 1
-#     normalized_score = np.tanh(score / 10000)
-#
-#     # Convert FEN to board
-#     board = chess.Board(fen)
-#     tensor = board_to_tensor(board)
-#
-#     x_train.append(tensor)
-#     y_train.append(normalized_score)
-#
-# x_train = np.array(x_train)
-# y_train = np.array(y_train)
-#
-# # Save arrays to disk
-# np.save('x_data.npy', x_train)
-# np.save('y_data.npy', y_train)
-# print("Finished saving arrays for training")
-#
-# # load existing arrays from disk
-# x_train = np.load('x_data.npy')
-# y_train = np.load('y_data.npy')
-#
-# # Create and train model
-# print("Starting to train the model")
-# model = create_model()
-# batch_size = 64
-# steps_per_epoch = len(x_train) // batch_size
-# model.fit(x=x_train, y=y_train, epochs=10, batch_size=batch_size, steps_per_epoch=steps_per_epoch)
-# print("Finished training the model")
-#
-# # Save the model
-# model = model.save('chess_model.h5')
-# print("Finished saving the model")
-
-# Load the model
-model = create_model()
-model.load_weights('chess_model.h5')
-optimizer = Adam(learning_rate=0.001)
-model.compile(loss='mean_squared_error', optimizer=optimizer, metrics=['mean_squared_error'])
-print("Finished loading the model")
+# Tensor plane of each Engine.GameState piece string, in the same order as PIECE_PLANES
+GAMESTATE_PLANES = {color + piece: plane for plane, (color, piece) in
+                    enumerate((color, piece) for color in 'bw' for piece in 'prnbqk')}
+
+
+# board_masks for an Engine.GameState or BitboardEngine.GameState, read straight from its board (or bitboards)
+# and its valid moves, without going through a FEN string or a python-chess board.
+# GameState rows run from rank 8 down, python-chess squares from rank 1 up, so the ranks are flipped.
+def gamestate_masks(gameState, validMoves=None):
+    masks = [0] * 14
+    bitboards = getattr(gameState, 'pieceBitboards', None)
+    if bitboards is not None:
+        # bit row * 8 + column with one byte per row, so reversing the bytes flips the ranks
+        for piece, bitboard in bitboards.items():
+            masks[GAMESTATE_PLANES[piece]] = int.from_bytes(bitboard.to_bytes(8, 'little'), 'big')
+    else:
+        for row in range(8):
+            for column in range(8):
+                piece = gameState.board[row][column]
+                if piece != '--':
+                    masks[GAMESTATE_PLANES[piece]] |= 1 << ((7 - row) * 8 + column)
+    targets = 0
+    for move in gameState.getValidMoves() if validMoves is None else validMoves:
+        targets |= 1 << ((7 - move.endRow) * 8 + move.endColumn)
+    masks[12 if gameState.whiteToMove else 13] = targets
+    return masks
+
+
+# board_to_tensor for a GameState, pass its validMoves when they are at hand to save generating them again
+def gamestate_to_tensor(gameState, validMoves=None):
+    return masks_to_tensors([gamestate_masks(gameState, validMoves)])[0]
+
+
+# Encode a list of boards into one (N, 8, 8, 16) uint8 array. Pass a preallocated out buffer of at least
+# len(boards) positions to avoid allocating one per batch; the encoded rows are returned as a view of it.
+def board_to_tensor_batch(boards, out=None):
+    masks = [board_masks(board) for board in boards]
+    return masks_to_tensors(masks, None if out is None else out[:len(masks)])
+
+
+# Build a function that evaluates a whole batch of boards in one forward pass and returns a (N, 1) array.
+# Calling the model directly inside a tf.function avoids the per-call setup that model.predict pays on every leaf.
+def make_batch_evaluator(model):
+    tf = load_tensorflow()
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + input_shape, dtype=tf.float32)])
+    def evaluate(tensors):
+        return model(tensors, training=False)
+    return lambda tensors: evaluate(tensors).numpy()
+
+
+# Save the weights of the trained model as plain NumPy arrays for forward_pass. The optimizer state is left out
+# and so are the Dropout layers, which only act during training.
+def export_weights(weights_path=WEIGHTS_PATH, export_path=EXPORT_PATH):
+    trained = create_model()
+    trained.load_weights(weights_path)
+    conv1, conv2, dense1, dense2 = [layer.get_weights() for layer in trained.layers if layer.get_weights()]
+    np.savez(export_path, conv1_kernel=conv1[0], conv1_bias=conv1[1], conv2_kernel=conv2[0], conv2_bias=conv2[1],
+             dense1_kernel=dense1[0], dense1_bias=dense1[1], dense2_kernel=dense2[0], dense2_bias=dense2[1])
+
+
+def load_exported_weights(export_path=EXPORT_PATH):
+    with np.load(export_path) as weights:
+        return {name: weights[name].astype(np.float32) for name in weights.files}
+
+
+# 3x3 convolution with 'same' padding over (N, 8, 8, C) as one matrix product: the 9 shifted copies of the
+# padded input are laid side by side in the (row, column, channel) order of the Keras kernel
+def conv3x3(x, kernel, bias):
+    padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+    patches = np.concatenate([padded[:, dy:dy + 8, dx:dx + 8] for dy in range(3) for dx in range(3)], axis=-1)
+    return patches @ kernel.reshape(-1, kernel.shape[-1]) + bias
+
+
+# The network of create_model in NumPy, without TensorFlow: returns the (N, 1) evaluations of (N, 8, 8, 16) tensors
+def forward_pass(weights, tensors):
+    x = np.maximum(conv3x3(tensors, weights['conv1_kernel'], weights['conv1_bias']), 0)
+    x = np.maximum(tensors + conv3x3(x, weights['conv2_kernel'], weights['conv2_bias']), 0)
+    x = np.maximum(x.reshape(len(x), -1) @ weights['dense1_kernel'] + weights['dense1_bias'], 0)
+    return np.tanh(x @ weights['dense2_kernel'] + weights['dense2_bias'])
+
+
+# The process-wide batch evaluator: forward_pass on the exported weights when EXPORT_PATH exists,
+# so playing does not need TensorFlow at all, otherwise the Keras model through make_batch_evaluator
+def get_batch_evaluator():
+    global evaluate_batch
+    if evaluate_batch is None:
+        if os.path.exists(EXPORT_PATH):
+            weights = load_exported_weights()
+            evaluate_batch = lambda tensors: forward_pass(weights, tensors)
+        else:
+            evaluate_batch = make_batch_evaluator(get_model())
+    return evaluate_batch
+
+
+# Positions and seconds spent in each stage of the training data pipeline, see report_pipeline_stats.
+# The encode seconds are summed over the worker processes.
+pipeline_stats = {'read': [0, 0.0], 'encode': [0, 0.0], 'feed': [0, 0.0]}
+
+
+# Read (FEN, Evaluation) rows from a chessData.csv-style file in chunks, without loading the whole file
+def read_csv_chunks(csv_path, chunk_size):
+    with open(csv_path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        fen_column, evaluation_column = header.index('FEN'), header.index('Evaluation')
+        while True:
+            start_time = time.perf_counter()
+            rows = [(row[fen_column], row[evaluation_column]) for row in itertools.islice(reader, chunk_size)]
+            pipeline_stats['read'][0] += len(rows)
+            pipeline_stats['read'][1] += time.perf_counter() - start_time
+            if not rows:
+                return
+            yield rows
+
+
+# Drop the mate scores ('#') from a chunk of rows, encode the positions and normalize the centipawn scores
+# to the range -1 to 1. Runs in the encoding pool, so it also returns the time it took.
+def encode_rows(rows):
+    start_time = time.perf_counter()
+    rows = [(fen, evaluation) for fen, evaluation in rows if not evaluation.startswith('#')]
+    x = board_to_tensor_batch([chess.Board(fen) for fen, _ in rows])
+    y = np.tanh(np.array([float(evaluation) for _, evaluation in rows], dtype=np.float32) / 10000)
+    return x, y, time.perf_counter() - start_time
+
+
+encoding_pool = None  # worker processes of stream_training_batches, started by its first call and kept for every epoch
+encoding_pool_size = 0
+
+
+# The encoding pool with the given number of workers (all cores for None), started once and reused.
+# The workers are spawned, not forked: this runs inside a tf.data generator, and forking a process in which
+# TensorFlow has started its threads can deadlock the child. Spawned workers import the main module again,
+# so a script that trains with this needs the usual if __name__ == "__main__" guard.
+def get_encoding_pool(workers=None):
+    global encoding_pool, encoding_pool_size
+    workers = workers or multiprocessing.cpu_count()
+    if encoding_pool_size != workers:
+        close_encoding_pool()
+        encoding_pool = multiprocessing.get_context('spawn').Pool(workers)
+        encoding_pool_size = workers
+    return encoding_pool
+
+
+def close_encoding_pool():
+    global encoding_pool, encoding_pool_size
+    if encoding_pool is not None:
+        encoding_pool.terminate()
+        encoding_pool.join()
+    encoding_pool = None
+    encoding_pool_size = 0
+
+
+# Encode the chunks of read_csv_chunks in the encoding pool and yield the results in order. At most two chunks
+# per worker are read ahead of the consumer, so a training step slower than the encoding holds the workers back
+# instead of piling encoded chunks up in memory.
+def encode_chunks(csv_path, chunk_size, workers=None):
+    pool = get_encoding_pool(workers)
+    pending = collections.deque()
+    for rows in read_csv_chunks(csv_path, chunk_size):
+        if len(pending) >= 2 * encoding_pool_size:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(encode_rows, (rows,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+# Stream (x, y) training batches from the csv file. Chunks are encoded in parallel by the encoding pool, shuffled
+# and cut into batches of batch_size as they arrive, so only a few chunks are in memory at a time.
+def stream_training_batches(csv_path, batch_size=64, chunk_size=10000, workers=None, max_positions=None, shuffle=True):
+    start_time = time.perf_counter()
+    positions = 0
+    x_rest = np.empty((0,) + input_shape, dtype=np.uint8)
+    y_rest = np.empty((0,), dtype=np.float32)
+    for x, y, elapsed in encode_chunks(csv_path, chunk_size, workers):
+        pipeline_stats['encode'][0] += len(x)
+        pipeline_stats['encode'][1] += elapsed
+        if shuffle:
+            order = np.random.permutation(len(x))
+            x, y = x[order], y[order]
+        x, y = np.concatenate([x_rest, x]), np.concatenate([y_rest, y])
+        if max_positions is not None:
+            x, y = x[:max_positions - positions], y[:max_positions - positions]
+        full = len(x) - len(x) % batch_size
+        for i in range(0, full, batch_size):
+            yield x[i:i + batch_size], y[i:i + batch_size]
+        positions += full
+        x_rest, y_rest = x[full:], y[full:]
+        if positions + len(x_rest) == max_positions:
+            break
+    if len(x_rest):
+        yield x_rest, y_rest
+    pipeline_stats['feed'][0] += positions + len(x_rest)
+    pipeline_stats['feed'][1] += time.perf_counter() - start_time
+
+
+# tf.data pipeline over the (x, y) batches that make_batches() yields, called again for every epoch,
+# with the uint8 tensors cast to float and batches prefetched
+def batch_dataset(make_batches):
+    tf = load_tensorflow()
+    dataset = tf.data.Dataset.from_generator(
+        make_batches,
+        output_signature=(tf.TensorSpec(shape=(None,) + input_shape, dtype=tf.uint8),
+                          tf.TensorSpec(shape=(None,), dtype=tf.float32)))
+    return dataset.map(lambda x, y: (tf.cast(x, tf.float32), y)).prefetch(tf.data.AUTOTUNE)
+
+
+def training_dataset(csv_path, batch_size=64, chunk_size=10000, workers=None, max_positions=None):
+    return batch_dataset(lambda: stream_training_batches(csv_path, batch_size, chunk_size, workers, max_positions))
+
+
+def report_pipeline_stats():
+    for stage, (positions, seconds) in pipeline_stats.items():
+        print(stage + ":", positions, "positions in", round(seconds, 2), "s,",
+              round(positions / max(seconds, 1e-9)), "positions/s" + (" per worker" if stage == 'encode' else ""))
+
+
+# Encode the csv file once into a directory of .npy shards of shard_size positions plus a manifest.json.
+# Every plane is 0/1, so with pack_bits the 16 planes of a square are packed into 2 bytes (128 bytes a position).
+def write_tensor_cache(csv_path, cache_dir, shard_size=100000, pack_bits=True, workers=None, max_positions=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = {'input_shape': list(input_shape), 'packed': pack_bits, 'positions': 0, 'shards': []}
+    x_parts, y_parts, count = [], [], 0
+
+    def write_shard():
+        name = 'shard_%05d' % len(manifest['shards'])
+        np.save(os.path.join(cache_dir, name + '_x.npy'), np.concatenate(x_parts))
+        np.save(os.path.join(cache_dir, name + '_y.npy'), np.concatenate(y_parts))
+        manifest['shards'].append({'x': name + '_x.npy', 'y': name + '_y.npy', 'positions': count})
+        manifest['positions'] += count
+
+    for x, y in stream_training_batches(csv_path, shard_size, workers=workers, max_positions=max_positions, shuffle=False):
+        x_parts.append(np.packbits(x, axis=-1) if pack_bits else x)
+        y_parts.append(y)
+        count += len(x)
+        if count == shard_size:
+            write_shard()
+            x_parts, y_parts, count = [], [], 0
+    if count:
+        write_shard()
+    # the manifest is written last, so a cache interrupted while writing is not mistaken for a complete one
+    with open(os.path.join(cache_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return TensorCache(cache_dir)
+
+
+# Read-only view of a cache written by write_tensor_cache. The shards are memory-mapped, so only the pages
+# that are actually read are loaded and memory stays bounded however many positions the cache holds.
+class TensorCache:
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.packed = manifest['packed']
+        self.x_shards = [np.load(os.path.join(cache_dir, shard['x']), mmap_mode='r') for shard in manifest['shards']]
+        self.y_shards = [np.load(os.path.join(cache_dir, shard['y']), mmap_mode='r') for shard in manifest['shards']]
+        # shard_starts[i] is the index of the first position of shard i
+        self.shard_starts = np.cumsum([0] + [shard['positions'] for shard in manifest['shards']])
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def unpack(self, x):
+        return np.unpackbits(x, axis=-1) if self.packed else np.asarray(x)
+
+    # Random access by position index, returns the (x, y) of a single position as a (8, 8, 16) tensor and a score
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("position index out of range")
+        index %= len(self)
+        shard = int(np.searchsorted(self.shard_starts, index, side='right')) - 1
+        offset = index - self.shard_starts[shard]
+        return self.unpack(self.x_shards[shard][offset]), float(self.y_shards[shard][offset])
+
+    # Yield (x, y) batches. With shuffle the shard order and the positions inside each shard are permuted,
+    # one shard at a time, so a batch only touches the pages of one memory-mapped shard.
+    def batches(self, batch_size=64, shuffle=True, seed=None):
+        rng = np.random.default_rng(seed)
+        shard_order = rng.permutation(len(self.x_shards)) if shuffle else range(len(self.x_shards))
+        for shard in shard_order:
+            x_shard, y_shard = self.x_shards[shard], self.y_shards[shard]
+            if shuffle:
+                order = rng.permutation(len(x_shard))
+                for i in range(0, len(order), batch_size):
+                    indices = np.sort(order[i:i + batch_size])
+                    yield self.unpack(x_shard[indices]), np.asarray(y_shard[indices])
+            else:
+                for i in range(0, len(x_shard), batch_size):
+                    yield self.unpack(x_shard[i:i + batch_size]), np.asarray(y_shard[i:i + batch_size])
+
+    # tf.data pipeline over batches(), reshuffled every time it is iterated (every epoch)
+    def dataset(self, batch_size=64, shuffle=True):
+        return batch_dataset(lambda: self.batches(batch_size, shuffle))
+
+
+# Create and train a model on the whole csv file, streaming it instead of loading it into memory.
+# With a cache_dir the positions are encoded into a tensor cache on the first run and read from it afterwards.
+def train_model(csv_path='chessData.csv', epochs=10, batch_size=64, max_positions=None, save_path=WEIGHTS_PATH,
+                cache_dir=None):
+    print("Starting to train the model")
+    model = create_model()
+    try:
+        if cache_dir is None:
+            dataset = training_dataset(csv_path, batch_size, max_positions=max_positions)
+        elif os.path.exists(os.path.join(cache_dir, 'manifest.json')):
+            dataset = TensorCache(cache_dir).dataset(batch_size)
+        else:
+            dataset = write_tensor_cache(csv_path, cache_dir, max_positions=max_positions).dataset(batch_size)
+        model.fit(dataset, epochs=epochs)
+    finally:
+        close_encoding_pool()
+    print("Finished training the model")
+    report_pipeline_stats()
+    model.save(save_path)
+    print("Finished saving the model")
+    return model
+
+
+leaf_count = 0  # leaves evaluated by the model since the last reset, for the leaves per second report
+
+
+# Model evaluations keyed by position (see position_key), bounded to max_size entries by evicting the least recently
+# used one.
+# The hit, miss and eviction counters are there to size it: see stats().
+class EvaluationCache:
+    def __init__(self, max_size=EVALUATION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+# Shared by every search in the process, so positions repeat across moves and games without being re-evaluated
+evaluation_cache = EvaluationCache()
+
+
+# Cache key of a position: its Polyglot Zobrist hash, which covers the pieces, the side to move, the castling rights
+# and the en passant square (only if a capture is legal) but not the move counters, which the model does not see
+def position_key(board):
+    return chess.polyglot.zobrist_hash(board)
+
+
+# Evaluate a list of board tensors with a single batched forward pass
+def evaluate_tensors(tensors):
+    global leaf_count
+    leaf_count += len(tensors)
+    return get_batch_evaluator()(np.asarray(tensors, dtype=np.float32))[:, 0]
+
+
+# Evaluate a single position, from evaluation_cache when it is there
+def evaluate_board(board):
+    key = position_key(board)
+    value = evaluation_cache.get(key)
+    if value is None:
+        value = float(evaluate_tensors([board_to_tensor(board)])[0])
+        evaluation_cache.put(key, value)
+    return value
+
+
+# Evaluate the position after each of the given moves. The ones in evaluation_cache are taken from it,
+# the rest are encoded and evaluated together in one batched forward pass.
+def evaluate_children(board, moves):
+    values = np.empty(len(moves), dtype=np.float32)
+    missing, keys, masks = [], [], []
+    for i, move in enumerate(moves):
+        board.push(move)
+        key = position_key(board)
+        value = evaluation_cache.get(key)
+        if value is None:
+            missing.append(i)
+            keys.append(key)
+            masks.append(board_masks(board))
+        else:
+            values[i] = value
+        board.pop()
+    if missing:
+        evaluated = evaluate_tensors(masks_to_tensors(masks))
+        values[missing] = evaluated
+        for key, value in zip(keys, evaluated):
+            evaluation_cache.put(key, float(value))
+    return values
+
 
 # Use principal variation search-like search to choose a move
-def choose_move(board, depth):
+# With batched=True the leaves are evaluated in batches (negamax_batched), otherwise one model.predict per leaf (negamax)
+def choose_move(board, depth, batched=True):
+    search = negamax_batched if batched else negamax
     legal_moves = list(board.legal_moves)
+    if batched and depth == 1:
+        scores = -evaluate_children(board, legal_moves)
+        return legal_moves[int(np.argmax(scores))]
     best_score = None
     best_move = None
     for move in legal_moves:
         board.push(move)
-        score = -negamax(board, depth-1, -float('inf'), float('inf'))
+        score = -search(board, depth-1, -float('inf'), float('inf'))
         board.pop()
         if best_score is None or score > best_score:
             best_score = score
@@ -139,8 +532,15 @@ def choose_move(board, depth):
 
 # Negamax search with alpha-beta pruning
 def negamax(board, depth, alpha, beta):
+    global leaf_count
     if depth == 0 or board.is_game_over():
-        return model.predict(np.expand_dims(board_to_tensor(board), axis=0))[0]
+        key = position_key(board)
+        value = evaluation_cache.get(key)
+        if value is None:
+            leaf_count += 1
+            value = float(get_model().predict(np.expand_dims(board_to_tensor(board), axis=0))[0][0])
+            evaluation_cache.put(key, value)
+        return value
     legal_moves = list(board.legal_moves)
     score = -float('inf')
     for move in legal_moves:
@@ -153,17 +553,99 @@ def negamax(board, depth, alpha, beta):
     return score
 
 
+# Negamax search with alpha-beta pruning that evaluates the leaves in batches.
+# At depth 1 every child is a leaf, so all of them are encoded and evaluated speculatively in one forward pass.
+# A cutoff could have skipped some of them, but the extra leaves are cheap inside the batch and the move chosen is the same.
+def negamax_batched(board, depth, alpha, beta):
+    if depth == 0 or board.is_game_over():
+        return evaluate_board(board)
+    legal_moves = list(board.legal_moves)
+    if depth == 1:
+        return -float(np.min(evaluate_children(board, legal_moves)))
+    score = -float('inf')
+    for move in legal_moves:
+        board.push(move)
+        score = max(score, -negamax_batched(board, depth-1, -beta, -alpha))
+        board.pop()
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+    return score
+
+
+# Time one search with batched leaf evaluation and one with a model.predict call per leaf, and report leaves per second.
+# The evaluation cache is cleared before each, so both evaluate every leaf with the model.
+def benchmark_leaf_evaluation(board, depth=2):
+    global leaf_count
+    for batched in (True, False):
+        leaf_count = 0
+        evaluation_cache.clear()
+        start_time = time.perf_counter()
+        move = choose_move(board, depth, batched)
+        elapsed = time.perf_counter() - start_time
+        print("batched" if batched else "per-leaf", "search:", move.uci(), leaf_count, "leaves in",
+              round(elapsed, 2), "s,", round(leaf_count / elapsed), "leaves/s")
+
+
+# Measure the cost of starting up: importing this module in a fresh interpreter, loading the evaluator
+# (the exported weights, or TensorFlow and the model), then a first and a second evaluation
+def benchmark_startup():
+    command = 'import time; start_time = time.perf_counter(); import Model; print(time.perf_counter() - start_time)'
+    result = subprocess.run([sys.executable, '-c', command], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    print("import Model:", round(float(result.stdout.split()[-1]), 3), "s")
+    tensors = [board_to_tensor(chess.Board())]
+    evaluator = "numpy" if os.path.exists(EXPORT_PATH) else "tensorflow"
+    for stage, run in (("load " + evaluator + " evaluator", get_batch_evaluator),
+                       ("first evaluation", lambda: evaluate_tensors(tensors)),
+                       ("second evaluation", lambda: evaluate_tensors(tensors))):
+        start_time = time.perf_counter()
+        run()
+        print(stage + ":", round(time.perf_counter() - start_time, 3), "s")
+
+
+# Latency of evaluating a single position with model.predict, the tf.function evaluator and forward_pass
+def benchmark_inference(repeats=200):
+    tensors = np.asarray([board_to_tensor(chess.Board())], dtype=np.float32)
+    weights = load_exported_weights()
+    keras_model = get_model()
+    tf_evaluator = make_batch_evaluator(keras_model)
+    for name, run in (("model.predict", lambda: keras_model.predict(tensors, verbose=0)),
+                      ("tf.function", lambda: tf_evaluator(tensors)),
+                      ("numpy forward pass", lambda: forward_pass(weights, tensors))):
+        run()
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            run()
+        print(name + ":", round((time.perf_counter() - start_time) / repeats * 1e6), "us per position")
+
+
 # Play a game against Stockfish
-engine = chess.engine.SimpleEngine.popen_uci('/usr/local/Cellar/stockfish/15.1/bin/stockfish')
-board = chess.Board()
-while not board.is_game_over():
-    move = choose_move(board, 1)  # Change this to search deeper
-    print("Model moves: " + move.uci())
-    board.push(move)
-    print(board)
-    if not board.is_game_over():
-        result = engine.play(board, chess.engine.Limit(time=2.0))
-        print("Stockfish moves: " + result.move.uci())
-        board.push(result.move)
+def play_against_stockfish(stockfish_path=STOCKFISH_PATH, depth=1):
+    engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+    board = chess.Board()
+    while not board.is_game_over():
+        move = choose_move(board, depth)
+        print("Model moves: " + move.uci())
+        board.push(move)
         print(board)
-engine.quit()
+        if not board.is_game_over():
+            result = engine.play(board, chess.engine.Limit(time=2.0))
+            print("Stockfish moves: " + result.move.uci())
+            board.push(result.move)
+            print(board)
+    engine.quit()
+    print("Evaluation cache:", evaluation_cache.stats())
+
+
+# python Model.py [stockfish path] plays a game against Stockfish, python Model.py export writes EXPORT_PATH,
+# python Model.py benchmark measures the startup and python Model.py benchmark-inference the evaluation latency
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['export']:
+        export_weights()
+    elif sys.argv[1:2] == ['benchmark']:
+        benchmark_startup()
+    elif sys.argv[1:2] == ['benchmark-inference']:
+        benchmark_inference()
+    else:
+        play_against_stockfish(*sys.argv[1:2])
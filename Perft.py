@@ -0,0 +1,104 @@
+"""
+This file is responsible for measuring and validating the move generators of Engine.GameState and BitboardEngine.GameState.
+perft counts the leaf nodes of the legal move tree to a fixed depth, divide splits that count by root move.
+The suite compares the counts of well-known positions against reference numbers and reports nodes per second,
+and the measured speedup of BitboardEngine.GameState over Engine.GameState on this machine.
+Run it with: python Perft.py [maximum depth]
+"""
+import sys
+import time
+import Engine
+import BitboardEngine
+
+# (name, FEN, node counts for depth 1, 2, ...). GameState always promotes to a queen, so the counts are those of
+# queen-only promotion. Where that differs from the published numbers, the published ones are in the comment.
+REFERENCE_POSITIONS = [
+    ("initial position", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", [20, 400, 8902, 197281]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 228, 8087]),  # 6, 264, 9467
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [41, 1373, 54007]),  # 44, 1486, 62379
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890]),
+    ("illegal en passant pin", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138]),
+    ("en passant discovered check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931]),
+    ("en passant gives check", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", [13, 102, 1266, 10276]),
+    ("en passant out of check", "8/5bk1/8/2Pp4/8/1K6/8/8 w - d6 0 1", [8, 104, 736, 9287]),
+    ("castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399]),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418]),
+    ("castling through pawn attacks", "4k3/8/8/8/8/8/4p3/R3K2R w KQ - 0 1", [22, 100, 2531, 14951]),
+    ("long castling through a pawn attack", "r3k2r/1P6/8/8/8/8/8/4K3 b kq - 0 1", [25, 146, 3282, 26545]),
+    ("castle rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826]),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509]),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [5, 75, 694, 9674]),  # 11, 133, 1442, 19174
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160]),
+    ("pawn pinned towards its king", "K7/8/3R4/3p4/8/3k4/8/8 b - - 0 1", [9, 118, 897, 14256]),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", [6, 28, 248, 1379]),  # 9, 40, 472, 2661
+    ("under promote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [3, 13, 111, 553]),  # 6, 27, 273, 1329
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", [2, 6, 13, 63, 331]),  # 2, 6, 13, 63, 382
+    ("stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", [7, 19, 129, 498, 4217]),  # 10, 25, 268, 926, 10857
+]
+BACKENDS = [Engine.GameState, BitboardEngine.GameState]
+nodeRates = {}  # backend -> nodes per second over the whole suite of the last runSuite
+
+
+'''
+Count the leaf nodes of the legal move tree to the given depth
+'''
+def perft(gameState, depth):
+    moves = gameState.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gameState.makeMove(move)
+        nodes += perft(gameState, depth - 1)
+        gameState.undoMove()
+    return nodes
+
+
+'''
+Perft split by root move, to narrow a wrong count down to the move that causes it
+'''
+def divide(gameState, depth):
+    counts = {}
+    for move in gameState.getValidMoves():
+        gameState.makeMove(move)
+        counts[move.getChessNotation()] = perft(gameState, depth - 1) if depth > 1 else 1
+        gameState.undoMove()
+    return counts
+
+
+'''
+Run perft on every reference position up to maxDepth, print the node counts and node rates
+and return whether all counts matched
+'''
+def runSuite(backend=Engine.GameState, maxDepth=3):
+    allMatched = True
+    totalNodes = 0
+    totalTime = 0
+    for name, fen, expectedCounts in REFERENCE_POSITIONS:
+        gameState = backend()
+        gameState.loadFEN(fen)
+        for depth, expected in enumerate(expectedCounts[:maxDepth], 1):
+            startTime = time.perf_counter()
+            nodes = perft(gameState, depth)
+            elapsed = time.perf_counter() - startTime
+            totalNodes += nodes
+            totalTime += elapsed
+            result = "ok" if nodes == expected else "MISMATCH (expected " + str(expected) + ")"
+            if nodes != expected:
+                allMatched = False
+            print(name + " depth " + str(depth) + ": " + str(nodes) + " nodes, " + str(int(nodes / max(elapsed, 1e-9))) +
+                  " nodes/s " + result)
+    nodeRates[backend] = totalNodes / max(totalTime, 1e-9)
+    print(backend.__module__ + ".GameState: " + str(totalNodes) + " nodes in " + format(totalTime, '.2f') + "s (" +
+          str(int(totalNodes / max(totalTime, 1e-9))) + " nodes/s), " + ("all counts match" if allMatched else "MISMATCHES FOUND"))
+    return allMatched
+
+
+if __name__ == "__main__":
+    depthLimit = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    results = [runSuite(backend, depthLimit) for backend in BACKENDS]
+    print("BitboardEngine.GameState is " + format(nodeRates[BitboardEngine.GameState] / nodeRates[Engine.GameState], '.1f') +
+          "x as fast as Engine.GameState on the suite in this run")
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,263 @@
+"""
+This file is responsible for benchmarking ChessAI's search on a fixed set of positions.
+It reports the nodes searched, the depth reached and the nodes per second of findBestMove and of
+findBestMoveParallel with a growing number of worker processes.
+The regression mode checks the search refinements against the plain search: node counts and time to depth of
+null-move pruning and late-move reductions, node counts of principal variation search with aspiration windows,
+the root move ordering, the zugzwang guard, and the moves found in a set of tactical positions.
+Run it with: python SearchBenchmark.py [milliseconds per position]
+         or: python SearchBenchmark.py regression [depth]
+"""
+import multiprocessing
+import random
+import sys
+import time
+import BitboardEngine
+import ChessAI
+
+ChessAI.USE_OPENING_BOOK = False  # the benchmarks measure the search, a book move would answer without one
+ChessAI.USE_TABLEBASES = False  # and so would a tablebase, which also cuts the endgame searches short
+
+# (name, FEN) of middlegame and endgame positions with different amounts of tactics
+BENCHMARK_POSITIONS = [
+    ("initial position", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"),
+    ("italian game", "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("queen endgame", "8/5pk1/6p1/8/8/3Q2P1/5P1K/3q4 w - - 0 1"),
+]
+# (name, FEN, the only move that wins). The mates are checked by brute force, so no search may miss them
+TACTICAL_POSITIONS = [
+    ("scholar's mate", "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", "h5f7"),
+    ("back rank mate", "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "d1d8"),
+    ("quiet mate in 2", "kbK5/pp6/1P6/8/8/8/8/R7 w - - 0 1", "a1a6"),
+    ("knight sacrifice mate in 2", "r2qkb1r/pp2nppp/3p4/2pNN1B1/2BnP3/3P4/PPP2PPP/R2bK2R w KQkq - 1 1", "d5f6"),
+    ("rook sacrifice mate in 2", "6k1/pp4p1/2p5/2bp4/8/P5Pb/1P3rrP/2BRRN1K b - - 0 1", "g2g1"),
+    ("knight fork", "2q1k3/8/8/1N6/8/8/8/4K3 w - - 0 1", "b5d6"),
+]
+# kings, pawns and a bishop, where the zugzwang guard must keep every null move out of the search
+ZUGZWANG_GUARD_POSITION = "8/2k5/3p4/p2P1p2/P4P2/6B1/4K3/8 w - - 0 1"
+# black gets mated whatever it plays, the search still has to return one of its moves
+LOST_POSITION = "3k4/6R1/K3p3/2p5/8/8/6Q1/8 b - - 0 1"
+
+
+'''
+Search every benchmark position with search(gameState, validMoves, timeMs) and return the total nodes,
+the total seconds and the depth reached in each position
+'''
+def runSearches(search, timeMs):
+    totalNodes = 0
+    totalTime = 0
+    depths = []
+    for name, fen in BENCHMARK_POSITIONS:
+        gameState = BitboardEngine.GameState()
+        gameState.loadFEN(fen)
+        ChessAI.transpositionTable.clear()
+        startTime = time.perf_counter()
+        search(gameState, gameState.getValidMoves(), timeMs)
+        totalTime += time.perf_counter() - startTime
+        totalNodes += ChessAI.nodeCount
+        depths.append(ChessAI.completedDepth)
+    return totalNodes, totalTime, depths
+
+
+'''
+Compare the nodes per second of findBestMove with findBestMoveParallel on 2, 4, ... worker processes,
+up to maxProcesses
+'''
+def benchmarkParallel(timeMs=2000, maxProcesses=8):
+    nodes, seconds, depths = runSearches(ChessAI.findBestMove, timeMs)
+    baseRate = nodes / seconds
+    print("findBestMove: " + str(nodes) + " nodes, " + str(int(baseRate)) + " nodes/s, depths " + str(depths))
+    processes = 2
+    while processes <= maxProcesses:
+        nodes, seconds, depths = runSearches(
+            lambda gameState, validMoves, timeMs: ChessAI.findBestMoveParallel(gameState, validMoves, timeMs, processes=processes),
+            timeMs)
+        print("findBestMoveParallel, " + str(processes) + " processes: " + str(nodes) + " nodes, " + str(int(nodes / seconds)) +
+              " nodes/s (" + format(nodes / seconds / baseRate, '.2f') + "x), depths " + str(depths))
+        processes *= 2
+
+
+'''
+Switch null-move pruning and late-move reductions on or off together
+'''
+def setSelectiveSearch(enabled):
+    ChessAI.NULL_MOVE_PRUNING = enabled
+    ChessAI.LATE_MOVE_REDUCTIONS = enabled
+
+
+'''
+Fixed-depth findBestMove on a fresh transposition table with a seeded shuffle, so node counts are reproducible.
+Returns the move, the nodes and the seconds
+'''
+def searchToDepth(fen, depth):
+    gameState = BitboardEngine.GameState()
+    gameState.loadFEN(fen)
+    ChessAI.transpositionTable.clear()
+    random.seed(0)
+    startTime = time.perf_counter()
+    move = ChessAI.findBestMove(gameState, gameState.getValidMoves(), timeMs=None, maxDepth=depth)
+    return move, ChessAI.nodeCount, time.perf_counter() - startTime
+
+
+'''
+Nodes and seconds of the full-width search at fullWidthDepth against the selective search at depth and depth + 1
+on the benchmark positions. Passes if the selective search needs fewer nodes at the same depth
+'''
+def checkNodeCounts(depth=4, fullWidthDepth=3):
+    results = {}
+    for enabled, depths in ((False, (fullWidthDepth, depth)), (True, (depth, depth + 1))):
+        setSelectiveSearch(enabled)
+        for searchDepth in depths:
+            nodes = seconds = 0
+            for name, fen in BENCHMARK_POSITIONS:
+                move, positionNodes, positionSeconds = searchToDepth(fen, searchDepth)
+                nodes += positionNodes
+                seconds += positionSeconds
+            results[enabled, searchDepth] = nodes, seconds
+            print(("selective" if enabled else "full width") + " depth " + str(searchDepth) + ": " + str(nodes) +
+                  " nodes in " + format(seconds, '.2f') + "s")
+    setSelectiveSearch(True)
+    fullWidthNodes = results[False, depth][0]
+    selectiveNodes = results[True, depth][0]
+    print("depth " + str(depth) + ": " + format(selectiveNodes / fullWidthNodes, '.2f') + "x the nodes of the full-width search")
+    return selectiveNodes < fullWidthNodes
+
+
+'''
+With only kings, pawns and a minor piece on the board the null move must never be tried, so the node count has to be
+the same with and without null-move pruning
+'''
+def checkZugzwangGuard(depth=5):
+    ChessAI.LATE_MOVE_REDUCTIONS = False
+    nodeCounts = []
+    for enabled in (False, True):
+        ChessAI.NULL_MOVE_PRUNING = enabled
+        nodeCounts.append(searchToDepth(ZUGZWANG_GUARD_POSITION, depth)[1])
+    setSelectiveSearch(True)
+    passed = nodeCounts[0] == nodeCounts[1]
+    print("zugzwang guard: " + str(nodeCounts[0]) + " and " + str(nodeCounts[1]) + " nodes in the minor piece ending " +
+          ("ok" if passed else "MISMATCH"))
+    return passed
+
+
+'''
+Nodes with and without principal variation search and aspiration windows, in the full-width and in the selective
+search. Passes if they save nodes in both and no quiescence node in check is told it is not, so it would stand pat.
+Re-searches reuse move lists, so that is where a stale check flag would show up
+'''
+def checkPrincipalVariationSearch(depth=4):
+    passed = True
+    standPatsInCheck = [0]
+    quiescence = ChessAI.findMoveQuiescence
+
+    def checkedQuiescence(gameState, validMoves, alpha, beta, turnMultiplier, inCheck):
+        if not inCheck and gameState.isInCheck():
+            standPatsInCheck[0] += 1
+        return quiescence(gameState, validMoves, alpha, beta, turnMultiplier, inCheck)
+
+    ChessAI.findMoveQuiescence = checkedQuiescence
+    try:
+        for selective in (False, True):
+            setSelectiveSearch(selective)
+            nodeCounts = []
+            for enabled in (False, True):
+                ChessAI.PRINCIPAL_VARIATION_SEARCH = ChessAI.ASPIRATION_WINDOWS = enabled
+                nodeCounts.append(sum(searchToDepth(fen, depth)[1] for name, fen in BENCHMARK_POSITIONS))
+            if nodeCounts[1] >= nodeCounts[0]:
+                passed = False
+            print(("selective" if selective else "full width") + " depth " + str(depth) + ": " + str(nodeCounts[0]) +
+                  " nodes, with principal variation search and aspiration windows " + str(nodeCounts[1]) + " (" +
+                  format(nodeCounts[1] / nodeCounts[0], '.2f') + "x)")
+    finally:
+        ChessAI.findMoveQuiescence = quiescence
+        setSelectiveSearch(True)
+    if standPatsInCheck[0]:
+        passed = False
+    print("quiescence nodes in check that could stand pat: " + str(standPatsInCheck[0]) +
+          (" ok" if not standPatsInCheck[0] else " WRONG"))
+    return passed
+
+
+'''
+From depth 2 on the root has to search the best move of the previous iteration first, in the full-width and in the
+selective search. The root is never stored in the transposition table, so this is the ordering it gets without a hash move
+'''
+def checkRootMoveOrdering(depth=4):
+    misordered = []
+    search = ChessAI.findMoveNegaMaxAlphaBeta
+
+    def checkedSearch(gameState, validMoves, searchDepth, *args, **kwargs):
+        if searchDepth != ChessAI.rootDepth or searchDepth < 2 or not ChessAI.principalVariation:
+            return search(gameState, validMoves, searchDepth, *args, **kwargs)
+        previousBest = ChessAI.principalVariation[0].moveID
+        try:
+            return search(gameState, validMoves, searchDepth, *args, **kwargs)
+        finally:  # the root sorts validMoves in place and searches them in that order
+            if validMoves[0].moveID != previousBest:
+                misordered.append((searchDepth, validMoves[0].getChessNotation()))
+
+    ChessAI.findMoveNegaMaxAlphaBeta = checkedSearch
+    try:
+        for selective in (False, True):
+            setSelectiveSearch(selective)
+            for name, fen in BENCHMARK_POSITIONS:
+                searchToDepth(fen, depth)
+    finally:
+        ChessAI.findMoveNegaMaxAlphaBeta = search
+        setSelectiveSearch(True)
+    print("root searches that did not start with the previous best move: " + str(len(misordered)) +
+          (" ok" if not misordered else " WRONG " + str(misordered)))
+    return not misordered
+
+
+'''
+In a position where every move gets mated, findBestMove and findBestMoveParallel still have to return a legal move
+'''
+def checkLostPosition(depth=4):
+    passed = True
+    for name, search in (("findBestMove", ChessAI.findBestMove),
+                         ("findBestMoveParallel", lambda gameState, validMoves, timeMs, maxDepth:
+                          ChessAI.findBestMoveParallel(gameState, validMoves, timeMs, maxDepth=maxDepth, processes=2))):
+        gameState = BitboardEngine.GameState()
+        gameState.loadFEN(LOST_POSITION)
+        validMoves = gameState.getValidMoves()
+        ChessAI.transpositionTable.clear()
+        move = search(gameState, validMoves, None, depth)
+        legal = move in validMoves
+        if not legal:
+            passed = False
+        print("lost position, " + name + ": " + (move.getChessNotation() if move is not None else "no move") + " " +
+              ("ok" if legal else "WRONG (expected a legal move)"))
+    return passed
+
+
+'''
+Every tactical position has to be solved by the selective search at the given depth
+'''
+def checkTactics(depth=4):
+    setSelectiveSearch(True)
+    passed = True
+    for name, fen, expected in TACTICAL_POSITIONS:
+        move, nodes, seconds = searchToDepth(fen, depth)
+        found = move.getChessNotation()
+        if found != expected:
+            passed = False
+        variation = " ".join(variationMove.getChessNotation() for variationMove in ChessAI.principalVariation)
+        print(name + ": " + found + " in " + str(nodes) + " nodes, pv " + variation + " " +
+              ("ok" if found == expected else "WRONG (expected " + expected + ")"))
+    return passed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "regression":
+        depthLimit = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        results = [checkNodeCounts(depthLimit), checkPrincipalVariationSearch(depthLimit),
+                   checkRootMoveOrdering(depthLimit), checkZugzwangGuard(depthLimit + 1),
+                   checkTactics(depthLimit), checkLostPosition(depthLimit)]
+        sys.exit(0 if all(results) else 1)
+    benchmarkParallel(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, max(2, min(8, multiprocessing.cpu_count())))
@@ -0,0 +1,528 @@
+"""
+This file is responsible for the endgame tablebases: the exact result and distance to mate of every position with
+few pieces, found by retrograde analysis and stored as one signed byte per position in a file per material signature.
+A signature names the white pieces, then the black ones, kings first: KQvK, KRvKN, KPvKP. Files are stored with the
+stronger side as white; positions of the other color are probed with the board flipped.
+A value is from the side to move's point of view: v > 0 mates in v plies, v < 0 gets mated in -v - 1 plies
+(-1 is checkmated), 0 is a draw. The white king is folded onto a 10 square triangle (a file half with pawns) by the
+symmetries of the board, which cuts a 3 piece file to 80 KB and a pawnless 4 piece one to 5 MB.
+The files are memory-mapped, so a probe only reads the page of the position it looks up.
+GameState always promotes to a queen, so the tables do too. En passant captures and the fifty-move rule are left out.
+Generate them with: python Tablebase.py [KQvK KRvK KPvK KQvKR ...]
+"""
+import mmap
+import os
+import sys
+import time
+from array import array
+from itertools import product
+from BitboardEngine import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, \
+    QUEEN_DIRECTIONS, SQUARES, slidingAttacks, squaresOf
+
+TABLEBASE_DIRECTORY = 'tablebases'  # where ChessAI looks for the files
+MAX_PIECES = 4  # kings included
+DEFAULT_SIGNATURES = ('KQvK', 'KRvK', 'KPvK')  # made by running this file without arguments
+PIECE_ORDER = 'kqrbnp'  # order of the pieces of a side within a signature
+DRAWN_SIGNATURES = ('KvK', 'KBvK', 'KNvK')  # no position of these is a mate, so they need no file
+DRAWN_MATERIALS = {'KvK', 'KBvK', 'KNvK', 'KvKB', 'KvKN'}  # the same with either color stronger
+MAX_PLIES = 126  # the longest distance to mate a signed byte holds
+NO_EXIT = -128  # marks a position without captures or promotions while generating
+SLIDING_DIRECTIONS = {'q': QUEEN_DIRECTIONS, 'r': ROOK_DIRECTIONS, 'b': BISHOP_DIRECTIONS}
+
+
+def _transform(flipRows, flipColumns, transpose):
+    table = []
+    for row, column in SQUARES:
+        if transpose:  # reflection in the a1-h8 diagonal
+            row, column = 7 - column, 7 - row
+        if flipRows:
+            row = 7 - row
+        if flipColumns:
+            column = 7 - column
+        table.append(row * 8 + column)
+    return table
+
+
+# the 8 symmetries of the board, identity first; pawns only allow the first two (left-right mirroring)
+TRANSFORMS = [_transform(flipRows, flipColumns, transpose)
+              for transpose, flipRows, flipColumns in product((False, True), repeat=3)]
+PAWN_TRANSFORMS = TRANSFORMS[:2]
+# the squares the white king is folded onto: a1-d1-d4 without pawns, the a to d files with them
+PAWNLESS_REGION = [row * 8 + column for row, column in SQUARES if column <= 3 and row >= 7 - column]
+PAWN_REGION = [row * 8 + column for row, column in SQUARES if column <= 3]
+
+
+'''
+Value of a position whose move leads to a position of the given value (which is from the opponent's point of view)
+'''
+def parentValue(childValue):
+    if childValue < 0:
+        return -childValue
+    if childValue > 0:
+        return -childValue - 2
+    return 0
+
+
+'''
+Sort key of a value for the side to move: quicker wins first, then draws, then slower losses
+'''
+def valueRank(value):
+    if value > 0:
+        return 1000 - value
+    if value < 0:
+        return -1000 - value
+    return 0
+
+
+def pieceOrder(entry):
+    return PIECE_ORDER.index(entry[0])
+
+
+'''
+Signature of two lists of piece letters, kings included, e.g. (['k', 'q'], ['k']) -> 'KQvK'
+'''
+def signatureOf(whitePieces, blackPieces):
+    return ''.join(sorted(whitePieces, key=PIECE_ORDER.index)).upper() + 'v' + \
+        ''.join(sorted(blackPieces, key=PIECE_ORDER.index)).upper()
+
+
+'''
+Whether the black pieces of a signature outrank the white ones, so positions of it are looked up with colors swapped.
+More pieces outrank fewer, otherwise the pieces are compared from the strongest down
+'''
+def isFlipped(signature):
+    white, black = signature.lower().split('v')
+    return (len(black), [-PIECE_ORDER.index(piece) for piece in black]) > \
+        (len(white), [-PIECE_ORDER.index(piece) for piece in white])
+
+
+'''
+Signature with the colors swapped, KvKQ -> KQvK
+'''
+def flippedSignature(signature):
+    white, black = signature.split('v')
+    return black + 'v' + white
+
+
+class TableLayout:
+    '''
+    How the positions of a signature map to offsets in its file. The pieces are listed white king, the other
+    white pieces, black king, the other black pieces, and a position is the side to move and a square per piece.
+    The offset is (side to move, white king region square, the other squares) in mixed radix, after folding the
+    white king into the region with a symmetry. Where two symmetries fold it there (a king on the diagonal)
+    the smaller offset is the one used, so every position has exactly one offset.
+    '''
+    def __init__(self, signature):
+        self.signature = signature
+        white, black = signature.lower().split('v')
+        self.pieces = [('w', piece) for piece in white] + [('b', piece) for piece in black]
+        self.kingIndex = {'w': 0, 'b': len(white)}
+        self.hasPawns = 'p' in white + black
+        self.region = PAWN_REGION if self.hasPawns else PAWNLESS_REGION
+        self.regionIndex = [-1] * 64
+        for index, square in enumerate(self.region):
+            self.regionIndex[square] = index
+        transforms = PAWN_TRANSFORMS if self.hasPawns else TRANSFORMS
+        # the symmetries that fold a white king on each square into the region
+        self.foldings = [[transform for transform in transforms if self.regionIndex[transform[square]] >= 0]
+                         for square in range(64)]
+        self.size = 2 * len(self.region) * 64 ** (len(self.pieces) - 1)
+
+    '''
+    Offset of a position, squares in the piece order of the layout
+    '''
+    def index(self, whiteToMove, squares):
+        best = None
+        for transform in self.foldings[squares[0]]:
+            index = (0 if whiteToMove else 1) * len(self.region) + self.regionIndex[transform[squares[0]]]
+            for square in squares[1:]:
+                index = index * 64 + transform[square]
+            if best is None or index < best:
+                best = index
+        return best
+
+    '''
+    (whiteToMove, squares) of an offset, the inverse of index for the positions it returns
+    '''
+    def position(self, index):
+        squares = []
+        for piece in range(len(self.pieces) - 1):
+            squares.append(index % 64)
+            index //= 64
+        squares.append(self.region[index % len(self.region)])
+        squares.reverse()
+        return index // len(self.region) == 0, squares
+
+
+class Tablebases:
+    '''
+    The tablebase files of a directory. Each is memory-mapped the first time a position of its signature is probed.
+    '''
+    def __init__(self, directory=TABLEBASE_DIRECTORY):
+        self.directory = directory
+        self.tables = {}  # signature -> signed byte values, or None if there is no file
+        self.layouts = {}
+        self.materials = {}  # signature as probed, e.g. KvKQ -> (whether colors are swapped, values, layout)
+        self.files = []
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.release()  # an mmap can't close while views of it exist
+        for file, data in self.files:
+            data.close()
+            file.close()
+        self.files = []
+        self.tables = {}
+        self.materials = {}
+
+    def path(self, signature):
+        return os.path.join(self.directory, signature + '.tb')
+
+    '''
+    The values of a signature, or None if its file is missing
+    '''
+    def table(self, signature):
+        if signature not in self.tables:
+            path = self.path(signature)
+            table = None
+            if os.path.exists(path):
+                file = open(path, 'rb')
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.files.append((file, data))
+                table = memoryview(data).cast('b')
+                if len(table) != self.layout(signature).size:
+                    raise ValueError(path + " does not have the size of a " + signature + " table, generate it again")
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def layout(self, signature):
+        if signature not in self.layouts:
+            self.layouts[signature] = TableLayout(signature)
+        return self.layouts[signature]
+
+    '''
+    Value of a position given as (color, piece, square) triples, or None if its table is missing
+    '''
+    def probePieces(self, pieces, whiteToMove):
+        white = sorted(((piece, square) for color, piece, square in pieces if color == 'w'), key=pieceOrder)
+        black = sorted(((piece, square) for color, piece, square in pieces if color == 'b'), key=pieceOrder)
+        material = ''.join([piece for piece, square in white]).upper() + 'v' + \
+            ''.join([piece for piece, square in black]).upper()
+        if material in DRAWN_MATERIALS:
+            return 0
+        if material not in self.materials:
+            signature = material
+            flipped = isFlipped(signature)
+            if flipped:
+                signature = flippedSignature(signature)
+            self.materials[material] = (flipped, self.table(signature), self.layout(signature))
+        flipped, table, layout = self.materials[material]
+        if table is None:
+            return None
+        if flipped:
+            white, black = [(piece, square ^ 56) for piece, square in black], [(piece, square ^ 56) for piece, square in white]
+            whiteToMove = not whiteToMove
+        squares = [square for piece, square in white] + [square for piece, square in black]
+        return table[layout.index(whiteToMove, squares)]
+
+    '''
+    Value of the position of a GameState, or None if it has too many pieces, its table is missing,
+    or castling or an en passant capture could be possible (the tables know neither)
+    '''
+    def probe(self, gameState):
+        rights = gameState.currentCastlingRight
+        if rights.whiteKingSide or rights.whiteQueenSide or rights.blackKingSide or rights.blackQueenSide:
+            return None
+        pieces = []
+        for row in range(8):
+            for column, piece in enumerate(gameState.board[row]):
+                if piece != '--':
+                    if len(pieces) == MAX_PIECES:
+                        return None
+                    if piece[1] == 'p' and gameState.enPassantPossible != () and \
+                            piece[0] == ('w' if gameState.whiteToMove else 'b'):
+                        return None
+                    pieces.append((piece[0], piece[1], row * 8 + column))
+        return self.probePieces(pieces, gameState.whiteToMove)
+
+
+'''
+Squares a piece on square attacks (for a pawn: captures) with the given occupancy
+'''
+def attacks(color, piece, square, occupied):
+    if piece == 'k':
+        return KING_ATTACKS[square]
+    if piece == 'n':
+        return KNIGHT_ATTACKS[square]
+    if piece == 'p':
+        return PAWN_ATTACKS[color][square]
+    return slidingAttacks(square, occupied, SLIDING_DIRECTIONS[piece])
+
+
+'''
+Whether the king of color is attacked. The piece with index captured (if any) has been taken and attacks nothing
+'''
+def kingAttacked(layout, squares, color, captured=-1):
+    king = squares[layout.kingIndex[color]]
+    occupied = 0
+    for index, square in enumerate(squares):
+        if index != captured:
+            occupied |= 1 << square
+    for index, (pieceColor, piece) in enumerate(layout.pieces):
+        if pieceColor != color and index != captured and attacks(pieceColor, piece, squares[index], occupied) >> king & 1:
+            return True
+    return False
+
+
+'''
+Whether the squares make a position that can come up in a game with the given side to move
+'''
+def isLegal(layout, squares, whiteToMove):
+    if len(set(squares)) != len(squares):
+        return False
+    for (color, piece), square in zip(layout.pieces, squares):
+        if piece == 'p' and square // 8 in (0, 7):
+            return False
+    return not kingAttacked(layout, squares, 'b' if whiteToMove else 'w')
+
+
+'''
+Legal moves of the side to move as (piece index, end square, index of the captured piece or -1, whether it promotes)
+'''
+def generateMoves(layout, squares, whiteToMove):
+    color = 'w' if whiteToMove else 'b'
+    occupied = own = 0
+    owner = {}
+    for index, ((pieceColor, piece), square) in enumerate(zip(layout.pieces, squares)):
+        occupied |= 1 << square
+        owner[square] = index
+        if pieceColor == color:
+            own |= 1 << square
+    moves = []
+    for index, (pieceColor, piece) in enumerate(layout.pieces):
+        if pieceColor != color:
+            continue
+        start = squares[index]
+        if piece == 'p':
+            step, startRow, lastRow = (-8, 6, 0) if color == 'w' else (8, 1, 7)
+            targets = PAWN_ATTACKS[color][start] & occupied & ~own
+            if not occupied >> (start + step) & 1:
+                targets |= 1 << (start + step)
+                if start // 8 == startRow and not occupied >> (start + 2 * step) & 1:
+                    targets |= 1 << (start + 2 * step)
+        else:
+            lastRow = -1
+            targets = attacks(color, piece, start, occupied) & ~own
+        for end in squaresOf(targets):
+            captured = owner.get(end, -1)
+            newSquares = list(squares)
+            newSquares[index] = end
+            if not kingAttacked(layout, newSquares, color, captured):
+                moves.append((index, end, captured, end // 8 == lastRow))
+    return moves
+
+
+'''
+Positions (squares) from which the side that is not to move could have made a non-capturing, non-promoting move
+to the given position. Those are the moves that stay in the table, the others lead into smaller tables
+'''
+def generateUnmoves(layout, squares, whiteToMove):
+    color = 'b' if whiteToMove else 'w'
+    occupied = 0
+    for square in squares:
+        occupied |= 1 << square
+    predecessors = []
+    for index, (pieceColor, piece) in enumerate(layout.pieces):
+        if pieceColor != color:
+            continue
+        end = squares[index]
+        if piece == 'p':
+            step, doubleRow = (8, 4) if color == 'w' else (-8, 3)
+            starts = 0
+            start = end + step
+            if 8 <= start < 56 and not occupied >> start & 1:  # no pawn comes from its last row
+                starts |= 1 << start
+                if end // 8 == doubleRow and not occupied >> (start + step) & 1:
+                    starts |= 1 << (start + step)
+        else:
+            starts = attacks(color, piece, end, occupied) & ~occupied
+        for start in squaresOf(starts):
+            newSquares = list(squares)
+            newSquares[index] = start
+            # the side that moved is to move in the predecessor, so its opponent must not be in check there
+            if not kingAttacked(layout, newSquares, 'b' if color == 'w' else 'w'):
+                predecessors.append(newSquares)
+    return predecessors
+
+
+'''
+Solve a signature by retrograde analysis. The tables its captures and promotions lead to must be available in
+tablebases. Returns the values as an array of signed bytes
+'''
+def generateTable(signature, tablebases, log=print):
+    layout = TableLayout(signature)
+    size = layout.size
+    pieceCount = len(layout.pieces)
+    values = array('b', bytes(size))
+    resolved = bytearray(size)  # 1 once the value of a position is final
+    remaining = bytearray(size)  # moves staying in the table not yet known to lose
+    longestLoss = bytearray(size)  # longest of the losses those moves have shown so far, in plies
+    exitValues = array('b', [NO_EXIT]) * size  # best value reached by a capture or promotion
+    buckets = [[] for _ in range(MAX_PLIES + 2)]  # plies -> (offset, value) of positions to settle at that distance
+    startTime = time.perf_counter()
+
+    # 1. every position: mates, stalemates, move counts and the values of captures and promotions
+    legalCount = 0
+    for whiteToMove in (True, False):
+        for king in layout.region:
+            for others in product(range(64), repeat=pieceCount - 1):
+                squares = [king]
+                squares.extend(others)
+                if not isLegal(layout, squares, whiteToMove):
+                    continue
+                index = layout.index(whiteToMove, squares)
+                if layout.position(index)[1] != squares:
+                    continue  # a symmetric twin of the position stored at index
+                legalCount += 1
+                successors = set()
+                bestExit = NO_EXIT
+                moves = generateMoves(layout, squares, whiteToMove)
+                for pieceIndex, end, captured, promotes in moves:
+                    if captured < 0 and not promotes:
+                        newSquares = list(squares)
+                        newSquares[pieceIndex] = end
+                        successors.add(layout.index(not whiteToMove, newSquares))
+                        continue
+                    pieces = []
+                    for index2, ((color, piece), square) in enumerate(zip(layout.pieces, squares)):
+                        if index2 == captured:
+                            continue
+                        if index2 == pieceIndex:
+                            piece, square = ('q' if promotes else piece), end
+                        pieces.append((color, piece, square))
+                    childValue = tablebases.probePieces(pieces, not whiteToMove)
+                    if childValue is None:
+                        raise ValueError(signature + " needs the table of " +
+                                         signatureOf([piece for color, piece, square in pieces if color == 'w'],
+                                                     [piece for color, piece, square in pieces if color == 'b']))
+                    value = parentValue(childValue)
+                    if bestExit == NO_EXIT or valueRank(value) > valueRank(bestExit):
+                        bestExit = value
+                if not moves:
+                    if kingAttacked(layout, squares, 'w' if whiteToMove else 'b'):
+                        buckets[0].append((index, -1))
+                    else:
+                        resolved[index] = 1  # stalemate
+                    continue
+                remaining[index] = len(successors)
+                exitValues[index] = bestExit
+                if bestExit > 0:
+                    buckets[bestExit].append((index, bestExit))
+                elif not successors:
+                    if bestExit < 0:
+                        buckets[-bestExit - 1].append((index, bestExit))
+                    else:
+                        resolved[index] = 1
+    log(signature + ": " + str(legalCount) + " positions, moves generated in " +
+        format(time.perf_counter() - startTime, '.1f') + "s")
+
+    # 2. settle positions in order of distance to mate. A position lost in n plies makes every predecessor a win
+    # in n + 1, a position won in n takes a move away from its predecessors, which are lost once they run out of moves
+    for plies in range(MAX_PLIES + 1):
+        for index, value in buckets[plies]:
+            if resolved[index]:
+                continue
+            resolved[index] = 1
+            values[index] = value
+            whiteToMove, squares = layout.position(index)
+            predecessors = set(layout.index(not whiteToMove, newSquares)
+                               for newSquares in generateUnmoves(layout, squares, whiteToMove))
+            for predecessor in predecessors:
+                if resolved[predecessor]:
+                    continue
+                if value < 0:
+                    buckets[plies + 1].append((predecessor, plies + 1))
+                    continue
+                remaining[predecessor] -= 1
+                longestLoss[predecessor] = max(longestLoss[predecessor], value + 1)
+                exitValue = exitValues[predecessor]
+                if remaining[predecessor] == 0 and exitValue < 0:  # every move loses (exitValue may be NO_EXIT)
+                    lossPlies = longestLoss[predecessor]
+                    if exitValue != NO_EXIT:
+                        lossPlies = max(lossPlies, -exitValue - 1)
+                    if lossPlies > MAX_PLIES:
+                        raise ValueError(signature + " has mates longer than a byte holds")
+                    buckets[lossPlies].append((predecessor, -lossPlies - 1))
+        buckets[plies] = None
+    if buckets[MAX_PLIES + 1]:
+        raise ValueError(signature + " has mates longer than a byte holds")
+    log(signature + ": solved in " + format(time.perf_counter() - startTime, '.1f') + "s, " + summary(layout, values))
+    return values
+
+
+'''
+Counts of wins, draws and losses for white to move and the longest mate, for the generator's log
+'''
+def summary(layout, values):
+    half = layout.size // 2
+    whiteValues = values[:half]
+    wins = sum(1 for value in whiteValues if value > 0)
+    losses = sum(1 for value in whiteValues if value < 0)
+    longest = max(max(values), -min(values) - 1)
+    return "white to move wins " + str(wins) + ", loses " + str(losses) + ", longest mate " + str(longest) + " plies"
+
+
+'''
+Signatures the captures and promotions of a signature lead to, as stored (stronger side white)
+'''
+def dependencies(signature):
+    white, black = signature.lower().split('v')
+    children = set()
+    for side, other, isWhite in ((white, black, True), (black, white, False)):
+        for position, piece in enumerate(side):
+            if piece == 'k':
+                continue
+            rest = side[:position] + side[position + 1:]
+            if piece == 'p':
+                children.add((rest + 'q', other) if isWhite else (other, rest + 'q'))
+            children.add((rest, other) if isWhite else (other, rest))
+    result = set()
+    for childWhite, childBlack in children:
+        child = signatureOf(list(childWhite), list(childBlack))
+        if isFlipped(child):
+            child = flippedSignature(child)
+        if child != signatureOf(list(white), list(black)):
+            result.add(child)
+    return result - set(DRAWN_SIGNATURES) - {'KvK'}
+
+
+'''
+Generate the file of a signature, and first the files of the tables it depends on that are missing
+'''
+def generate(signature, tablebases, log=print):
+    if isFlipped(signature):
+        signature = flippedSignature(signature)
+    if signature in DRAWN_SIGNATURES or tablebases.table(signature) is not None:
+        return
+    for child in sorted(dependencies(signature)):
+        generate(child, tablebases, log)
+    values = generateTable(signature, tablebases, log)
+    os.makedirs(tablebases.directory, exist_ok=True)
+    with open(tablebases.path(signature), 'wb') as file:
+        file.write(values.tobytes())
+    tablebases.close()  # forget the table was missing, the new file is mapped on the next probe
+
+
+if __name__ == "__main__":
+    requested = sys.argv[1:] or DEFAULT_SIGNATURES
+    for name in requested:
+        white, black = name.lower().split('v')
+        if white.count('k') != 1 or black.count('k') != 1 or len(white + black) > MAX_PIECES or \
+                any(piece not in PIECE_ORDER for piece in white + black):
+            sys.exit("not a signature of at most " + str(MAX_PIECES) + " pieces: " + name)
+    generatedTablebases = Tablebases()
+    for name in requested:
+        white, black = name.lower().split('v')
+        generate(signatureOf(list(white), list(black)), generatedTablebases)
+    generatedTablebases.close()